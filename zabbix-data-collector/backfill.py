@@ -0,0 +1,185 @@
+import asyncio
+import aiohttp
+import argparse
+import logging
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+from collector import setup_logging, load_config, get_auth_for_instance
+from database_manager import DatabaseManager
+from db_writer import DatabaseWriter
+from http_session import create_http_session
+from item_keys import disk_item_field
+from token_cache import TokenCache, create_token_cache
+from zabbix_collector import ZabbixCollector
+from zabbix_types import InstanceRunStatus, ZabbixInstance
+
+
+class BackfillAggregator:
+    def __init__(self, item_map: Dict[str, Tuple[int, Optional[str], str]], bucket_seconds: int):
+        # itemid -> (server_id, mount_point, field); mount_point is None for agent.ping
+        self.item_map = item_map
+        self.bucket_seconds = bucket_seconds
+        self.availability = {}  # (server_id, bucket) -> is_available
+        self.disk_space = defaultdict(dict)  # (server_id, mount_point, bucket) -> {field: value}
+
+    def add(self, records) -> None:
+        for record in records:
+            mapping = self.item_map.get(record['itemid'])
+            if mapping is None:
+                continue
+            server_id, mount_point, field = mapping
+            bucket = int(record['clock']) // self.bucket_seconds * self.bucket_seconds
+            # history.get returns 'value', trend.get returns hourly min/avg/max
+            value = float(record['value'] if 'value' in record else record['value_avg'])
+
+            if mount_point is None:
+                key = (server_id, bucket)
+                self.availability[key] = self.availability.get(key, False) or value >= 1
+            else:
+                # Records arrive sorted by clock, so the last one in a bucket wins
+                self.disk_space[(server_id, mount_point, bucket)][field] = value
+
+    def drain(self, db_manager: DatabaseManager, run_id: int) -> int:
+        rows = 0
+        for (server_id, bucket), is_available in self.availability.items():
+            db_manager.queue_infra_availability(server_id, is_available, run_id, datetime.fromtimestamp(bucket))
+            rows += 1
+
+        for (server_id, mount_point, bucket), data in self.disk_space.items():
+            disk_data = ZabbixCollector.disk_space_data(mount_point, data, datetime.fromtimestamp(bucket))
+            if disk_data is None:
+                continue
+            db_manager.queue_disk_space(server_id, disk_data)
+            rows += 1
+
+        self.availability = {}
+        self.disk_space = defaultdict(dict)
+        return rows
+
+
+async def backfill_instance(instance: ZabbixInstance, db_writer: DatabaseWriter, session: aiohttp.ClientSession,
+                            time_from: int, time_till: int, options: argparse.Namespace,
+                            token_cache: Optional[TokenCache] = None) -> bool:
+    logging.info(f"Backfilling plant {instance['plant_name']} from {datetime.fromtimestamp(time_from)} "
+                 f"to {datetime.fromtimestamp(time_till)} using {'trends' if options.trends else 'history'}")
+    zabbix_auth = None
+    run_id = None
+    rows = 0
+    started_at = datetime.now()
+    try:
+        zabbix_auth = await get_auth_for_instance(instance, session, token_cache)
+        instance['token'] = zabbix_auth.auth_token
+
+        async with ZabbixCollector(instance, session, auth=zabbix_auth) as zabbix_collector:
+            plant_id = await db_writer.get_plant_id(instance['plant_name'])
+            if plant_id is None:
+                logging.error(f"Plant {instance['plant_name']} not found in the database.")
+                return False
+
+            servers = await zabbix_collector.get_servers()
+            server_ids = await db_writer.resolve_servers(plant_id, servers)
+            items_by_host = await zabbix_collector.get_items_by_host([server['hostid'] for server in servers])
+
+            # Hosts whose item.get failed get no history; the backfill is then recorded as partial
+            failed_hosts = [server['name'] for server in servers if items_by_host.get(server['hostid'], []) is None]
+            if failed_hosts:
+                logging.error(f"Item lookup failed for {len(failed_hosts)} hosts of plant {instance['plant_name']}, "
+                              f"their history is not backfilled: {', '.join(failed_hosts)}")
+
+            item_map = {}
+            itemids_by_type = defaultdict(list)
+            for hostid, items in items_by_host.items():
+                server_id = server_ids.get(hostid)
+                if server_id is None or items is None:
+                    continue
+                for item in items:
+                    if item['key_'] == 'agent.ping':
+                        item_map[item['itemid']] = (server_id, None, 'is_available')
+                    else:
+                        disk_field = disk_item_field(item['key_'])
+                        if disk_field is None:
+                            continue
+                        item_map[item['itemid']] = (server_id, disk_field[0], disk_field[1])
+                    itemids_by_type[item.get('value_type', '3')].append(item['itemid'])
+            logging.info(f"Backfilling {len(item_map)} items on {len(server_ids)} servers for plant {instance['plant_name']}")
+
+            run_id = await db_writer.allocate_run_id(1)
+            aggregator = BackfillAggregator(item_map, options.bucket)
+            current_slice = None
+
+            async for slice_till, records in zabbix_collector.iter_history(
+                    itemids_by_type, time_from, time_till, options.slice, options.item_chunk, options.trends):
+                # A new slice means every bucket of the previous one is complete; write it out and let it go
+                if current_slice is not None and slice_till != current_slice:
+                    rows += await db_writer.drain(aggregator, run_id)
+                    logging.info(f"Backfilled plant {instance['plant_name']} up to {datetime.fromtimestamp(current_slice)} ({rows} rows)")
+                current_slice = slice_till
+                aggregator.add(records)
+
+            rows += await db_writer.drain(aggregator, run_id)
+
+        status = 'partial' if failed_hosts else 'success'
+        logging.info(f"Backfill completed ({status}) for plant {instance['plant_name']} with run_id {run_id}: {rows} rows")
+        await db_writer.finish_run(run_id, [InstanceRunStatus(
+            plant_name=instance['plant_name'], url=instance['url'], status=status, rows_written=rows,
+            started_at=started_at, finished_at=datetime.now())])
+        return not failed_hosts
+    except Exception as e:
+        logging.error(f"Error backfilling Zabbix instance {instance['url']}: {str(e)}")
+        if run_id is not None:
+            await db_writer.finish_run(run_id, [InstanceRunStatus(
+                plant_name=instance['plant_name'], url=instance['url'], status='failure', rows_written=rows,
+                started_at=started_at, finished_at=datetime.now())])
+        return False
+    finally:
+        if zabbix_auth:
+            await zabbix_auth.release()
+
+
+def parse_time(value: str) -> int:
+    return int(datetime.fromisoformat(value).timestamp())
+
+
+async def main(options: argparse.Namespace):
+    setup_logging()
+    try:
+        config = load_config(options.config)
+        db_manager = DatabaseManager(config['database'])
+    except Exception as e:
+        logging.error(f"Error initializing backfill: {str(e)}", exc_info=True)
+        return
+
+    time_from = parse_time(options.time_from)
+    time_till = parse_time(options.time_till)
+    # Align slices to bucket boundaries so a bucket never straddles two slices
+    time_from -= time_from % options.bucket
+    options.slice -= options.slice % options.bucket
+    if options.slice <= 0:
+        logging.error("--slice must be at least one --bucket long")
+        return
+
+    instances = [instance for instance in config['zabbix_instances']
+                 if not options.plant or instance['plant_name'] in options.plant]
+
+    db_writer = DatabaseWriter(db_manager)
+    token_cache = create_token_cache(config)
+    try:
+        async with create_http_session(config.get('http')) as http_session:
+            for instance in instances:
+                await backfill_instance(instance, db_writer, http_session, time_from, time_till, options, token_cache)
+    finally:
+        db_writer.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Backfill availability and disk space facts from Zabbix history')
+    parser.add_argument('--config', default='config.yml', help='path to the configuration file')
+    parser.add_argument('--from', dest='time_from', required=True, help='start of the range (ISO format, e.g. 2024-05-01)')
+    parser.add_argument('--to', dest='time_till', required=True, help='end of the range (ISO format)')
+    parser.add_argument('--plant', action='append', help='plant to backfill (repeatable, default all)')
+    parser.add_argument('--trends', action='store_true', help='use hourly trend.get instead of history.get')
+    parser.add_argument('--slice', type=int, default=3600, help='seconds of history fetched per page')
+    parser.add_argument('--bucket', type=int, default=300, help='seconds per backfilled fact row')
+    parser.add_argument('--item-chunk', type=int, default=200, help='items per history.get call')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,132 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+import tracemalloc
+from sqlalchemy import event
+from collector import process_zbx_instance
+from database_manager import DatabaseManager, Plant
+from db_writer import DatabaseWriter
+from host_inventory import HostInventory
+from http_session import create_http_session
+from mock_zabbix import MockZabbixServer
+from sinks import DatabaseSink
+
+
+async def run_benchmark(options: argparse.Namespace) -> dict:
+    server = MockZabbixServer(options.hosts, options.mounts, options.latency, options.error_rate,
+                              not options.no_batch)
+    url = await server.start()
+
+    db_url = options.db_url
+    if db_url is None:
+        db_path = os.path.join(tempfile.mkdtemp(prefix='zabbix-bench-'), 'benchmark.db')
+        db_url = f"sqlite:///{db_path}"
+    db_manager = DatabaseManager({'url': db_url, 'batch_size': options.batch_size}, load_caches=False)
+    db_manager.migrate_schema()
+
+    statements = {'count': 0, 'executemany': 0}
+
+    @event.listens_for(db_manager.engine, 'before_cursor_execute')
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements['count'] += 1
+        if executemany:
+            statements['executemany'] += 1
+
+    plant_names = [f"BenchPlant{index + 1}" for index in range(options.instances)]
+    with db_manager.Session() as session:
+        for plant_name in plant_names:
+            if db_manager.get_plant_id(plant_name) is None:
+                session.add(Plant(name=plant_name))
+        session.commit()
+
+    sink = DatabaseSink(DatabaseWriter(db_manager))
+    # Kept across runs, so only the first run lists hosts and items
+    host_inventory = HostInventory(None) if options.inventory else None
+    runs = []
+    try:
+        async with create_http_session() as http_session:
+            for run in range(options.runs):
+                server.http_requests = 0
+                statements['count'] = statements['executemany'] = 0
+                instances = [{
+                    'url': url, 'username': 'bench', 'password': 'bench', 'plant_name': plant_name,
+                    'bulk_collection': not options.per_host, 'host_chunk_size': options.chunk_size,
+                    'max_concurrency': options.concurrency, 'stream_responses': options.stream
+                } for plant_name in plant_names]
+
+                run_id = await sink.allocate_run_id(len(instances))
+                tracemalloc.start()
+                started = time.perf_counter()
+                results = await asyncio.gather(*(process_zbx_instance(instance, sink, http_session, run_id=run_id,
+                                                                      host_inventory=host_inventory)
+                                                 for instance in instances))
+                elapsed = time.perf_counter() - started
+                _, peak_memory = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+
+                hosts = options.hosts * options.instances
+                runs.append({
+                    'run': run + 1,
+                    'succeeded': sum(1 for result in results if result),
+                    'seconds': round(elapsed, 3),
+                    'hosts_per_second': round(hosts / elapsed, 1) if elapsed else None,
+                    'http_requests': server.http_requests,
+                    'db_statements': statements['count'],
+                    'db_executemany': statements['executemany'],
+                    'peak_memory_mb': round(peak_memory / 1024 ** 2, 2)
+                })
+    finally:
+        sink.close()
+        await server.stop()
+
+    return {
+        'hosts_per_instance': options.hosts,
+        'instances': options.instances,
+        'mounts_per_host': options.mounts,
+        'latency': options.latency,
+        'error_rate': options.error_rate,
+        'api_calls': dict(server.calls),
+        'runs': runs
+    }
+
+
+def print_report(report: dict) -> None:
+    print(f"{report['instances']} instance(s) x {report['hosts_per_instance']} hosts, "
+          f"{report['mounts_per_host']} mounts/host, latency {report['latency']}s, error rate {report['error_rate']}")
+    columns = ['run', 'succeeded', 'seconds', 'hosts_per_second', 'http_requests', 'db_statements',
+               'db_executemany', 'peak_memory_mb']
+    print('  '.join(f"{column:>16}" for column in columns))
+    for run in report['runs']:
+        print('  '.join(f"{str(run[column]):>16}" for column in columns))
+    print(f"API calls by method: {report['api_calls']}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the collector against a mock Zabbix API and SQLite')
+    parser.add_argument('--hosts', type=int, default=2000, help='hosts per instance')
+    parser.add_argument('--mounts', type=int, default=6, help='mount points per host')
+    parser.add_argument('--instances', type=int, default=1)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds added to every HTTP request')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--no-batch', action='store_true', help='mock rejects JSON-RPC batches')
+    parser.add_argument('--per-host', action='store_true', help='disable bulk collection')
+    parser.add_argument('--chunk-size', type=int, default=500)
+    parser.add_argument('--stream', action='store_true', help='parse item.get responses incrementally')
+    parser.add_argument('--inventory', action='store_true', help='cache hosts and item ids between runs')
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--batch-size', type=int, default=1000, help='DB rows per bulk insert')
+    parser.add_argument('--db-url', help='SQLAlchemy URL (default: temporary SQLite file)')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    options = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    report = asyncio.run(run_benchmark(options))
+    if options.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
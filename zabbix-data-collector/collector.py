@@ -1,92 +1,98 @@
 import asyncio
+import aiohttp
+import atexit
 import yaml
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 import os
+import queue
 import subprocess
+import time
 from datetime import datetime
-from database_manager import DatabaseManager
+from sinks import FactSink, create_sink
+from http_session import create_http_session
+from host_inventory import HostInventory, create_host_inventory
+from item_state import ItemStateStore, create_item_state
+from metrics import REGISTRY, INSTANCE_RUN_SECONDS, INSTANCE_RUNS, STARTUP_SECONDS
+from token_cache import TokenCache, create_token_cache
 from zabbix_auth import ZabbixAuth, get_zabbix_token
 from zabbix_collector import ZabbixCollector
-from zabbix_types import ZabbixInstance
+from typing import Optional, Tuple
+from zabbix_types import InstanceRunStatus, ZabbixInstance
+
+# Fallback start time where the OS does not expose it; misses the interpreter start and the imports above
+IMPORTED_AT = time.time()
 
 
 def setup_logging():
-    # Create logs directory if it doesn't exist
+    # One file and one console handler on the root logger, fed through a queue: logging calls only
+    # enqueue the record and a listener thread does the formatting and I/O, so the event loop never
+    # waits on the disk. Daemon, backfill and the other commands call this too; repeat calls are no-ops.
+    root = logging.getLogger()
+    if any(isinstance(handler, QueueHandler) for handler in root.handlers):
+        return
+
     log_dir = 'logs'
     os.makedirs(log_dir, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    log_file = os.path.join(log_dir, f'zabbix_collector_{timestamp}.log')
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
 
-    # Create a logger for this module
-    logger = logging.getLogger(__name__)
-    logger.setLevel(logging.DEBUG)
-
-    # Create a formatter
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-
-    # Create a file handler
     file_handler = RotatingFileHandler(
-        os.path.join(log_dir, 'collector.log'),
-        maxBytes=10*1024*1024,  # 10MB
-        backupCount=5
-    )
+        log_file, maxBytes=10*1024*1024, backupCount=5) # 10MB per file, keep 5 backups
     file_handler.setLevel(logging.DEBUG)
     file_handler.setFormatter(formatter)
 
-    # Create a console handler
     console_handler = logging.StreamHandler()
     console_handler.setLevel(logging.INFO)
     console_handler.setFormatter(formatter)
 
-    # Add handlers to the logger
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
-
-    logger.info("Logging initialized for collector module")
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    listener.start()
+    # Stopping the listener drains the queue, so records logged just before exit still reach the file
+    atexit.register(listener.stop)
 
-    # Generate a timestamp for the log filename
-    timestamp = datetime.now().strftime("%Y%M%d_%H%M%S")
-    log_file = os.path.join(log_dir, f'zabbix_collector_{timestamp}.log')
-
-    # Set up the root logger
-    logger = logging.getLogger()
-    logger.setLevel(logging.DEBUG)
-
-    # Create a rotating file handler
-    file_handler = RotatingFileHandler(
-        log_file, maxBytes=10*1024*1024, backupCount=5) # 10MB per file, keep 5 backups
-    file_handler.setLevel(logging.DEBUG)
+    root.handlers = [QueueHandler(log_queue)]
+    root.setLevel(logging.DEBUG)
+    logging.info(f"logging initialized. log file: {log_file}")
 
-    # Create a formatter and add it to the handler
-    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-    file_handler.setFormatter(formatter)
 
-    # Add the handler to the logger
-    logger.addHandler(file_handler)
+def process_started_at() -> float:
+    # Wall-clock start of this process from /proc on Linux (starttime is field 22, in clock ticks since boot)
+    try:
+        with open('/proc/self/stat', 'r') as file:
+            start_ticks = int(file.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime', 'r') as file:
+            uptime = float(file.read().split()[0])
+        return time.time() - uptime + start_ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return IMPORTED_AT
 
-    # why dafuq wouldn't you?!
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.INFO)
-    console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
 
-    logging.info(f"logging initialized. log file: {log_file}")
+def report_startup(command: str) -> None:
+    startup_seconds = time.time() - process_started_at()
+    STARTUP_SECONDS.observe(startup_seconds, command=command)
+    logging.info(f"Startup took {startup_seconds:.3f}s")
 
 
 def load_config(config_file):
     with open(config_file, 'r') as file:
         return yaml.safe_load(file)
 
-async def get_auth_for_instance(instance: ZabbixInstance) -> ZabbixAuth:
+async def get_auth_for_instance(instance: ZabbixInstance,
+                                session: Optional[aiohttp.ClientSession] = None,
+                                token_cache: Optional[TokenCache] = None) -> ZabbixAuth:
     try:
         if 'token' in instance and instance['token']:
             logging.info(f"Using provided API token for instance {instance['url']}")
-            auth = ZabbixAuth(instance['url'])
+            auth = ZabbixAuth(instance['url'], session)
             auth.auth_token = instance['token']
             return auth
         elif 'username' in instance and 'password' in instance:
             logging.info(f"Generating token using username/password for instance {instance['url']}")
-            auth = ZabbixAuth(instance['url'])
-            await auth.login(instance['username'], instance['password'])
+            auth = ZabbixAuth(instance['url'], session, token_cache)
+            await auth.ensure_login(instance['username'], instance['password'])
             return auth
         else:
             raise ValueError(f"Neither valid token nor credentials provided for Zabbix instance: {instance['url']}")
@@ -94,55 +100,120 @@ async def get_auth_for_instance(instance: ZabbixInstance) -> ZabbixAuth:
         logging.error(f"Error getting Zabbix auth for instance {instance['url']}: {str(e)}")
         raise
 
-async def process_zbx_instance(instance: ZabbixInstance, db_manager: DatabaseManager) -> bool:
+async def process_zbx_instance(instance: ZabbixInstance, sink: FactSink,
+                               session: Optional[aiohttp.ClientSession] = None,
+                               zabbix_auth: Optional[ZabbixAuth] = None,
+                               run_id: Optional[int] = None,
+                               item_state: Optional[ItemStateStore] = None,
+                               token_cache: Optional[TokenCache] = None,
+                               host_inventory: Optional[HostInventory] = None) -> bool:
+    status = await run_zbx_instance(instance, sink, session, zabbix_auth, run_id, item_state, token_cache,
+                                    host_inventory)
+    return status['status'] == 'success'
+
+async def run_zbx_instance(instance: ZabbixInstance, sink: FactSink,
+                           session: Optional[aiohttp.ClientSession] = None,
+                           zabbix_auth: Optional[ZabbixAuth] = None,
+                           run_id: Optional[int] = None,
+                           item_state: Optional[ItemStateStore] = None,
+                           token_cache: Optional[TokenCache] = None,
+                           host_inventory: Optional[HostInventory] = None) -> InstanceRunStatus:
+    started_at = datetime.now()
+    started = time.perf_counter()
+    result = await _process_zbx_instance(instance, sink, session, zabbix_auth, run_id, item_state, token_cache,
+                                         host_inventory)
+    if result is None:
+        status, rows = 'failure', 0
+    else:
+        # Hosts whose items could not be fetched were written with unknown availability
+        rows, hosts, failed_hosts = result
+        status = 'success' if not failed_hosts else 'partial' if failed_hosts < hosts else 'failure'
+        if failed_hosts:
+            logging.warning(f"No item data for {failed_hosts} of {hosts} hosts of plant {instance['plant_name']}, "
+                            f"recording the run as {status}")
+    INSTANCE_RUN_SECONDS.observe(time.perf_counter() - started, instance=instance['plant_name'])
+    INSTANCE_RUNS.inc(instance=instance['plant_name'], status=status)
+    return InstanceRunStatus(plant_name=instance['plant_name'], url=instance['url'], status=status,
+                             rows_written=rows, started_at=started_at, finished_at=datetime.now())
+
+def failed_instance_status(instance: ZabbixInstance) -> InstanceRunStatus:
+    # For instances whose task never produced a status (e.g. a crashed worker process)
+    now = datetime.now()
+    return InstanceRunStatus(plant_name=instance['plant_name'], url=instance['url'], status='failure',
+                             rows_written=0, started_at=now, finished_at=now)
+
+async def _process_zbx_instance(instance: ZabbixInstance, sink: FactSink,
+                                session: Optional[aiohttp.ClientSession],
+                                zabbix_auth: Optional[ZabbixAuth],
+                                run_id: Optional[int],
+                                item_state: Optional[ItemStateStore],
+                                token_cache: Optional[TokenCache],
+                                host_inventory: Optional[HostInventory] = None) -> Optional[Tuple[int, int, int]]:
+    # Returns the number of fact rows handed to the sink, of hosts, and of hosts whose item.get failed,
+    # or None if the run failed
     logging.info(f"Starting to process Zabbix instance: {instance['url']} for plant: {instance['plant_name']}")
-    zabbix_auth = None
+    # An auth handed in by the caller (daemon mode) stays logged in after the run
+    owns_auth = zabbix_auth is None
     try:
-        zabbix_auth = await get_auth_for_instance(instance)
+        if owns_auth:
+            zabbix_auth = await get_auth_for_instance(instance, session, token_cache)
         if not zabbix_auth or not zabbix_auth.auth_token:
             logging.error(f"Failed to obtain valid auth for instance {instance['url']}")
-            return False
+            return None
 
         instance['token'] = zabbix_auth.auth_token  # Update the instance with the token
 
-        async with ZabbixCollector(instance) as zabbix_collector:
-            plant_id = db_manager.get_plant_id(instance['plant_name'])
-
-            if plant_id is None:
+        last_clocks = item_state.get_clocks(instance['url']) if item_state else None
+        async with ZabbixCollector(instance, session, last_clocks, zabbix_auth) as zabbix_collector:
+            if not await sink.check_plant(instance['plant_name']):
                 logging.error(f"Plant {instance['plant_name']} not found in the database.")
-                return False
-
-            servers = await zabbix_collector.get_servers()
+                return None
+
+            refresh_task = None
+            itemids_by_host = None
+            if host_inventory is not None:
+                # Inside the TTL this skips hostgroup.get/host.get and fetches item values by itemid
+                inventory, refresh_task = await host_inventory.snapshot(instance['plant_name'], zabbix_collector)
+                servers = host_inventory.servers(inventory)
+                itemids_by_host = inventory['items']
+            else:
+                servers = await zabbix_collector.get_servers()
             logging.info(f"Found {len(servers)} servers for plant {instance['plant_name']}")
 
-            for server in servers:
-                try:
-                    server_name = server['name']
-                    server_id = db_manager.get_or_create_server(plant_id, server_name, server['hostid'])
-
-                    # Collect and insert availability data
-                    is_available = await zabbix_collector.get_server_availability(server)
-                    db_manager.insert_infra_availability(server_id, is_available)
-                    logging.info(f"Inserted availability data for server {server_name}: {'Available' if is_available else 'Unavailable'}")
-
-                    # Collect and insert disk space data
-                    disk_space_data = await zabbix_collector.get_server_disk_space(server['hostid'])
-                    for disk_data in disk_space_data:
-                        db_manager.insert_disk_space(server_id, disk_data)
-                        logging.info(f"Inserted disk space data for server {server_name}, mount point {disk_data['mount_point']}")
-
-                except Exception as e:
-                    logging.error(f"Error processing server {server_name} in plant {instance['plant_name']}: {str(e)}")
-                    continue
+            try:
+                # Collection fans out concurrently (bounded by max_concurrency); DB writes below stay serialized
+                if instance.get('bulk_collection', True):
+                    host_data = await zabbix_collector.get_bulk_server_data(servers, itemids_by_host)
+                else:
+                    server_data = await asyncio.gather(*(zabbix_collector.get_server_data(server, itemids_by_host)
+                                                         for server in servers))
+                    host_data = {server['hostid']: data for server, data in zip(servers, server_data)}
+
+                await sink.write_plant(instance['plant_name'], servers, host_data, run_id)
+
+                # Write whatever is still buffered for this plant
+                await sink.flush()
+            finally:
+                # A background refresh uses this collector's session and auth, so it must finish before they close
+                if refresh_task is not None:
+                    await refresh_task
+
+            # Only remember item clocks once their rows are safely written
+            if item_state is not None:
+                item_state.update(instance['url'], zabbix_collector.seen_clocks)
+                await asyncio.get_running_loop().run_in_executor(None, item_state.save)
+            if host_inventory is not None:
+                await asyncio.get_running_loop().run_in_executor(None, host_inventory.save)
 
         logging.info(f"Data collection completed for plant {instance['plant_name']}")
-        return True
+        return (sum(1 + len(data['disk_space']) + len(data['metrics']) for data in host_data.values()),
+                len(host_data), len(zabbix_collector.failed_hostids & host_data.keys()))
     except Exception as e:
         logging.error(f"Error processing Zabbix instance {instance['url']}: {str(e)}")
-        return False
+        return None
     finally:
-        if zabbix_auth:
-            await zabbix_auth.logout()
+        if owns_auth and zabbix_auth:
+            await zabbix_auth.release()
 
 #async def test_database_connection(db_manager):
 #    logging.info("Testing database connection...")
@@ -195,44 +266,67 @@ async def process_zbx_instance(instance: ZabbixInstance, db_manager: DatabaseMan
 #    logging.info("4. The server's network adapter has TCP/IP enabled")
 #    logging.info("5. Your client machine's firewall is not blocking outgoing connections to port 1433")
 
-async def main():
+async def main(config_file='config.yml'):
     setup_logging()
     try:
-        config = load_config('config.yml')
+        config = load_config(config_file)
         #logging.info(f"Loaded config: {config}")
 
         #check_odbc_driver()
 
         try:
-            db_manager = DatabaseManager(config['database'])
+            sink = create_sink(config)
         except ValueError as ve:
             logging.error(f"Configuration error: {str(ve)}")
             return
         except Exception as e:
-            logging.error(f"Error initializing DatabaseManager: {str(e)}", exc_info=True)
+            logging.error(f"Error initializing output sinks: {str(e)}", exc_info=True)
             return
 
-        logging.info(f"Initialized DatabaseManager with config: {config['database']}")
+        logging.info("Initialized output sinks")
 
         #if not await test_database_connection(db_manager):
         #    logging.error("DB connection test failed. Exiting...")
         #    return
 
-        logging.info(f"Starting data collection run with run_id: {db_manager.run_id}")
-
-        zabbix_instances = config['zabbix_instances']
-        logging.info(f"Found {len(zabbix_instances)} Zabbix instances in the configuration")
-
-        tasks = [process_zbx_instance(instance, db_manager) for instance in zabbix_instances]
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-
-        for instance, result in zip(zabbix_instances, results):
-            if isinstance(result, Exception):
-                logging.error(f"Error processing instance {instance['url']}: {str(result)}")
+        item_state = create_item_state(config)
+        token_cache = create_token_cache(config)
+        host_inventory = create_host_inventory(config)
+        report_startup('collector')
+        try:
+            zabbix_instances = config['zabbix_instances']
+            logging.info(f"Found {len(zabbix_instances)} Zabbix instances in the configuration")
+
+            run_id = await sink.allocate_run_id(len(zabbix_instances))
+            logging.info(f"Starting data collection run with run_id: {run_id}")
+
+            processes = int((config.get('sharding') or {}).get('processes', 1))
+            if processes > 1 and len(zabbix_instances) > 1:
+                # Imported here because the worker module imports this one
+                from sharding import run_sharded
+                results = await run_sharded(config, run_id, min(processes, len(zabbix_instances)),
+                                            item_state, token_cache, host_inventory)
             else:
-                logging.info(f"Finished processing instance {instance['url']} with result: {'Success' if result else 'Failure'}")
+                async with create_http_session(config.get('http')) as http_session:
+                    tasks = [run_zbx_instance(instance, sink, http_session, run_id=run_id, item_state=item_state,
+                                              token_cache=token_cache, host_inventory=host_inventory)
+                             for instance in zabbix_instances]
+                    results = await asyncio.gather(*tasks, return_exceptions=True)
+
+            statuses = []
+            for instance, result in zip(zabbix_instances, results):
+                if isinstance(result, Exception):
+                    logging.error(f"Error processing instance {instance['url']}: {str(result)}")
+                    result = failed_instance_status(instance)
+                else:
+                    logging.info(f"Finished processing instance {instance['url']} with result: {result['status']} ({result['rows_written']} rows)")
+                statuses.append(result)
+            await sink.finish_run(run_id, statuses)
+        finally:
+            sink.close()
 
         logging.info("All Zabbix instances have been processed")
+        REGISTRY.log_summary()
     except Exception as e:
         logging.error(f"Error in main: {str(e)}", exc_info=True)
 
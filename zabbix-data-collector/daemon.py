@@ -0,0 +1,164 @@
+import asyncio
+import aiohttp
+import argparse
+import logging
+import random
+import signal
+from typing import Dict, Optional
+from collector import setup_logging, load_config, get_auth_for_instance, failed_instance_status, report_startup, run_zbx_instance
+from sinks import FactSink, create_sink
+from host_inventory import create_host_inventory
+from http_session import create_http_session
+from item_state import create_item_state
+from metrics import start_metrics_server
+from token_cache import TokenCache, create_token_cache
+from zabbix_auth import ZabbixAuth
+from zabbix_types import ZabbixInstance
+
+
+class CollectorDaemon:
+    def __init__(self, config: dict, sink: FactSink, session: aiohttp.ClientSession):
+        daemon_config = config.get('daemon') or {}
+        self.instances = config['zabbix_instances']
+        self.sink = sink
+        self.session = session
+        self.default_interval = float(daemon_config.get('interval', 60))
+        self.jitter = float(daemon_config.get('jitter', 5))
+        self.overlap = daemon_config.get('overlap', 'skip')
+        self.shutdown_timeout = float(daemon_config.get('shutdown_timeout', 60))
+        self.item_state = create_item_state(config)
+        self.host_inventory = create_host_inventory(config)
+        # Without a configured cache the daemon still keeps tokens in memory for its whole lifetime
+        self.token_cache = create_token_cache(config) or TokenCache()
+        self.stop_event = asyncio.Event()
+        # Logged-in auth per instance url, kept across runs
+        self.auths: Dict[str, ZabbixAuth] = {}
+
+        if self.overlap not in ('skip', 'queue'):
+            raise ValueError(f"Invalid daemon overlap policy: {self.overlap} (expected 'skip' or 'queue')")
+
+    def install_signal_handlers(self) -> None:
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, self.stop)
+            except NotImplementedError:
+                # Windows event loops don't support add_signal_handler
+                signal.signal(sig, lambda signum, frame: loop.call_soon_threadsafe(self.stop))
+
+    def stop(self) -> None:
+        if not self.stop_event.is_set():
+            logging.info("Shutdown requested, finishing in-flight runs")
+            self.stop_event.set()
+
+    async def _sleep(self, delay: float) -> None:
+        try:
+            await asyncio.wait_for(self.stop_event.wait(), timeout=max(delay, 0))
+        except asyncio.TimeoutError:
+            pass
+
+    async def _get_auth(self, instance: ZabbixInstance) -> Optional[ZabbixAuth]:
+        auth = self.auths.get(instance['url'])
+        if auth is None or not auth.auth_token:
+            auth = await get_auth_for_instance(instance, self.session, self.token_cache)
+            self.auths[instance['url']] = auth
+        return auth
+
+    async def _release_auth(self, instance: ZabbixInstance) -> None:
+        auth = self.auths.pop(instance['url'], None)
+        if auth:
+            # Configured API tokens are long-lived and must not be logged out
+            if instance.get('token'):
+                await auth.close()
+            else:
+                await auth.release()
+
+    async def run_once(self, instance: ZabbixInstance) -> bool:
+        run_id = await self.sink.allocate_run_id(1)
+        logging.info(f"Starting scheduled run {run_id} for plant {instance['plant_name']}")
+        try:
+            zabbix_auth = await self._get_auth(instance)
+        except Exception as e:
+            logging.error(f"Skipping run {run_id} for plant {instance['plant_name']}: {str(e)}")
+            await self.sink.finish_run(run_id, [failed_instance_status(instance)])
+            return False
+
+        # run_zbx_instance writes the session token into the instance, so hand it a copy.
+        # Expired tokens are re-established by the collector on the first auth error.
+        status = await run_zbx_instance(dict(instance), self.sink, self.session, zabbix_auth, run_id,
+                                        self.item_state, host_inventory=self.host_inventory)
+        await self.sink.finish_run(run_id, [status])
+        return status['status'] == 'success'
+
+    async def run_instance(self, instance: ZabbixInstance) -> None:
+        loop = asyncio.get_running_loop()
+        interval = float(instance.get('interval', self.default_interval))
+        logging.info(f"Scheduling plant {instance['plant_name']} every {interval}s")
+
+        current: Optional[asyncio.Task] = None
+        next_run = loop.time() + random.uniform(0, self.jitter)
+        while not self.stop_event.is_set():
+            await self._sleep(next_run - loop.time())
+            if self.stop_event.is_set():
+                break
+
+            if current is not None and not current.done():
+                if self.overlap == 'skip':
+                    logging.warning(f"Previous run for plant {instance['plant_name']} still in progress, skipping this cycle")
+                else:
+                    logging.warning(f"Previous run for plant {instance['plant_name']} still in progress, queueing this cycle")
+                    await asyncio.wait([current])
+                    current = asyncio.create_task(self.run_once(instance))
+            else:
+                current = asyncio.create_task(self.run_once(instance))
+
+            # Keep to the fixed schedule, but don't try to catch up on cycles missed while running
+            next_run = max(next_run + interval, loop.time()) + random.uniform(0, self.jitter)
+
+        if current is not None and not current.done():
+            try:
+                await asyncio.wait_for(current, timeout=self.shutdown_timeout)
+            except asyncio.TimeoutError:
+                logging.error(f"Run for plant {instance['plant_name']} did not finish within {self.shutdown_timeout}s, cancelled")
+
+    async def run(self) -> None:
+        logging.info(f"Collector daemon started with {len(self.instances)} Zabbix instances")
+        try:
+            await asyncio.gather(*(self.run_instance(instance) for instance in self.instances))
+        finally:
+            for instance in self.instances:
+                await self._release_auth(instance)
+            await self.sink.flush()
+            logging.info("Collector daemon stopped")
+
+
+async def main(config_file='config.yml'):
+    setup_logging()
+    try:
+        config = load_config(config_file)
+        sink = create_sink(config)
+    except Exception as e:
+        logging.error(f"Error initializing collector daemon: {str(e)}", exc_info=True)
+        return
+    report_startup('daemon')
+
+    metrics_runner = None
+    try:
+        metrics_runner = await start_metrics_server(config.get('metrics'))
+        async with create_http_session(config.get('http')) as http_session:
+            daemon = CollectorDaemon(config, sink, http_session)
+            daemon.install_signal_handlers()
+            await daemon.run()
+    except Exception as e:
+        logging.error(f"Error in collector daemon: {str(e)}", exc_info=True)
+    finally:
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        sink.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the Zabbix data collector as a long-running daemon')
+    parser.add_argument('--config', default='config.yml', help='path to the configuration file')
+    args = parser.parse_args()
+    asyncio.run(main(args.config))
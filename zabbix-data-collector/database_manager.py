@@ -1,12 +1,16 @@
-from sqlalchemy import create_engine, Column, func, Integer, String, DateTime, Boolean, Float, event
+from sqlalchemy import create_engine, bindparam, Column, delete, func, insert, inspect, select, text, update, Integer, String, DateTime, Boolean, Float, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from datetime import datetime
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List
 import logging
-import pyodbc
+import threading
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
-from sqlalchemy.exc import OperationalError
+from sqlalchemy.exc import IntegrityError, OperationalError
 from urllib.parse import quote_plus
+from metrics import DB_OPERATION_SECONDS, DB_ROWS_DEDUPLICATED, DB_ROWS_WRITTEN
+from zabbix_types import InstanceRunStatus, ServerInfo
 
 
 Base = declarative_base()
@@ -42,25 +46,96 @@ class DiskSpace(Base):
     free_space = Column(Float)
     free_space_percent = Column(Float)
 
+class HostMetric(Base):
+    __tablename__ = 'fact_host_metric'
+    id = Column(Integer, primary_key=True)
+    server_id = Column(Integer)
+    timestamp = Column(DateTime)
+    metric = Column(String(100))
+    instance = Column(String)
+    value = Column(Float)
+    run_id = Column(Integer)
+
+class DiskSpaceState(Base):
+    # Last stored fact_disk_space values per mount, kept in step with the fact table by change-only storage
+    __tablename__ = 'etl_disk_space_state'
+    id = Column(Integer, primary_key=True)
+    server_id = Column(Integer, index=True)
+    mount_point = Column(String)
+    timestamp = Column(DateTime)
+    total_space = Column(Float)
+    used_space = Column(Float)
+
+class SpoolBatch(Base):
+    __tablename__ = 'etl_spool_batch'
+    id = Column(Integer, primary_key=True)
+    batch_key = Column(String(100), unique=True)
+    loaded_at = Column(DateTime)
+    row_count = Column(Integer)
+
+class EtlRun(Base):
+    __tablename__ = 'etl_run'
+    id = Column(Integer, primary_key=True)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    status = Column(String(20))
+    instance_count = Column(Integer)
+    rows_written = Column(Integer)
+
+class EtlRunInstance(Base):
+    __tablename__ = 'etl_run_instance'
+    id = Column(Integer, primary_key=True)
+    run_id = Column(Integer, index=True)
+    plant_name = Column(String)
+    instance_url = Column(String)
+    status = Column(String(20))
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    rows_written = Column(Integer)
+
 class DatabaseManager:
-    def __init__(self, db_config):
+    def __init__(self, db_config, load_caches=True):
+        # The schema is not checked here; schema.py creates and migrates tables as a one-off step
         self.config = db_config
         self.engine = self._create_engine()
-        Base.metadata.create_all(self.engine)
         self.Session = sessionmaker(bind=self.engine)
-        self.run_id = self._get_new_run_id()
+        self.batch_size = int(self.config.get('batch_size', 1000))
+        self._buffer_lock = threading.Lock()
+        self._availability_rows = []
+        self._disk_space_rows = []
+        self._host_metric_rows = []
+        # Dimension caches: plant name -> id, (plant_id, server_name) -> (server_id, zabbix_hostid)
+        self._plant_ids = {}
+        self._servers = {}
+        # Change-only disk space storage: (server_id, mount_point) -> last stored timestamp/total/used
+        dedup_config = self.config.get('disk_space_dedup') or {}
+        self.disk_space_dedup = bool(dedup_config.get('enabled', False))
+        self.dedup_threshold = float(dedup_config.get('threshold_percent', 1.0))
+        self.dedup_heartbeat = timedelta(seconds=float(dedup_config.get('heartbeat', 86400)))
+        self._disk_state = {}
+        # Servers whose mounts have been read from etl_disk_space_state; the rest are read on first write
+        self._disk_state_servers = set()
+        self._disk_state_lock = threading.Lock()
+        if load_caches:
+            self._load_dimensions()
 
     def _create_engine(self):
+        # A full SQLAlchemy URL (e.g. SQLite for benchmarks) bypasses the SQL Server settings below
+        if self.config.get('url'):
+            logging.info(f"Using database URL: {self.config['url']}")
+            return create_engine(self.config['url'], echo=self.config.get('echo', False))
+
         username = quote_plus(self.config['username'])
         password = quote_plus(self.config['password'])
         server = self.config['server']
         database = self.config['database']
         driver = quote_plus(self.config['driver'])
+        timeout = int(self.config.get('timeout', 60))
 
         conn_str = (
             f"mssql+pyodbc://{username}:{password}@{server}/{database}?"
             f"driver={driver}"
-            f"&timeout=60"
+            f"&timeout={timeout}"
             f"&TrustServerCertificate=yes"
             f"&encrypt=yes"
         )
@@ -68,73 +143,484 @@ class DatabaseManager:
 
         return create_engine(
             conn_str,
-            connect_args={'timeout': 60},
-            echo=True,
+            connect_args={'timeout': timeout},
+            echo=self.config.get('echo', False),
+            fast_executemany=True,
             pool_pre_ping=True,
             pool_recycle=3600
         )
 
+    def schema_changes(self):
+        # Tables missing entirely, and columns missing from existing tables (additive changes only)
+        inspector = inspect(self.engine)
+        existing_tables = set(inspector.get_table_names())
+        missing_tables = []
+        missing_columns = []
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                missing_tables.append(table)
+                continue
+            existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+            missing_columns.extend(column for column in table.columns if column.name not in existing_columns)
+        return missing_tables, missing_columns
+
+    def migrate_schema(self):
+        missing_tables, missing_columns = self.schema_changes()
+        try:
+            with self.engine.begin() as conn:
+                for table in missing_tables:
+                    table.create(conn)
+                    logging.info(f"Created table {table.name}")
+                for column in missing_columns:
+                    column_type = column.type.compile(dialect=self.engine.dialect)
+                    conn.execute(text(f"ALTER TABLE {column.table.name} ADD {column.name} {column_type}"))
+                    logging.info(f"Added column {column.table.name}.{column.name}")
+                if DiskSpaceState.__table__ in missing_tables:
+                    self._seed_disk_state_table(conn)
+            return len(missing_tables) + len(missing_columns)
+        except Exception as e:
+            logging.error(f"Error migrating the database schema: {str(e)}")
+            raise
+
+    def _load_dimensions(self):
+        try:
+            with self.Session() as session:
+                self._plant_ids = {name: plant_id for plant_id, name in session.execute(select(Plant.id, Plant.name))}
+                self._servers = {
+                    (plant_id, server_name): (server_id, zabbix_hostid)
+                    for server_id, plant_id, server_name, zabbix_hostid in session.execute(
+                        select(Server.id, Server.plant_id, Server.server_name, Server.zabbix_hostid))
+                }
+            logging.info(f"Loaded {len(self._plant_ids)} plants and {len(self._servers)} servers into the dimension cache")
+        except Exception as e:
+            logging.error(f"Error loading dimension cache: {str(e)}")
+            raise
+
     def get_plant_id(self, plant_name):
+        if plant_name in self._plant_ids:
+            return self._plant_ids[plant_name]
+
         try:
             with self.Session() as session:
                 plant = session.query(Plant).filter_by(name=plant_name).first()
+                if plant:
+                    self._plant_ids[plant_name] = plant.id
                 return plant.id if plant else None
         except Exception as e:
             logging.error(f"Error getting plant ID: {str(e)}")
             raise
 
     def get_or_create_server(self, plant_id, server_name, zabbix_hostid=None):
+        cached = self._servers.get((plant_id, server_name))
+        if cached:
+            return cached[0]
+
         try:
-            with self.Session() as session:
+            with DB_OPERATION_SECONDS.time(operation='get_or_create_server'), self.Session() as session:
                 server = session.query(Server).filter_by(plant_id=plant_id, server_name=server_name).first()
                 if not server:
                     server = Server(plant_id=plant_id, server_name=server_name, zabbix_hostid=zabbix_hostid)
                     session.add(server)
                     session.commit()
+                    DB_ROWS_WRITTEN.inc(table=Server.__tablename__)
+                self._servers[(plant_id, server_name)] = (server.id, server.zabbix_hostid)
                 return server.id
         except Exception as e:
             logging.error(f"Error in getting server ID: {str(e)}")
             raise
 
-    def _get_new_run_id(self):
+    def resolve_servers(self, plant_id, servers: List[ServerInfo]) -> Dict[str, int]:
+        missing = {}
+        changed = []
+        for server in servers:
+            cached = self._servers.get((plant_id, server['name']))
+            if cached is None:
+                missing[server['name']] = server['hostid']
+            elif cached[1] != server['hostid']:
+                changed.append({'server_id': cached[0], 'new_hostid': server['hostid']})
+
+        if missing or changed:
+            try:
+                with DB_OPERATION_SECONDS.time(operation='resolve_servers'), self.Session() as session:
+                    connection = session.connection()
+                    if missing:
+                        connection.execute(insert(Server.__table__), [
+                            {'plant_id': plant_id, 'server_name': name, 'zabbix_hostid': hostid}
+                            for name, hostid in missing.items()
+                        ])
+                    if changed:
+                        connection.execute(
+                            update(Server.__table__)
+                            .where(Server.__table__.c.id == bindparam('server_id'))
+                            .values(zabbix_hostid=bindparam('new_hostid')),
+                            changed
+                        )
+                    session.commit()
+                    DB_ROWS_WRITTEN.inc(len(missing) + len(changed), table=Server.__tablename__)
+
+                    # Re-read the plant's servers so newly created rows get their ids
+                    for server_id, server_name, zabbix_hostid in session.execute(
+                            select(Server.id, Server.server_name, Server.zabbix_hostid).where(Server.plant_id == plant_id)):
+                        self._servers[(plant_id, server_name)] = (server_id, zabbix_hostid)
+                logging.info(f"Created {len(missing)} and updated {len(changed)} servers for plant ID {plant_id}")
+            except Exception as e:
+                logging.error(f"Error resolving servers for plant ID {plant_id}: {str(e)}")
+                raise
+
+        return {
+            server['hostid']: self._servers[(plant_id, server['name'])][0]
+            for server in servers
+            if (plant_id, server['name']) in self._servers
+        }
+
+    def allocate_run_id(self, instance_count=None):
+        # Every run gets an etl_run row; the identity column keeps concurrent collectors apart
         try:
             with self.Session() as session:
-                max_run_id = session.query(func.max(InfraAvailability.run_id)).scalar()
-                return (max_run_id or 0) + 1
+                run = EtlRun(started_at=datetime.now(), status='running', instance_count=instance_count)
+                # Negative ids belong to runs spooled while the database was down (see DurableSink)
+                if session.query(EtlRun.id).filter(EtlRun.id > 0).first() is None:
+                    # First run against an existing database: continue after the run ids already in the facts.
+                    # The id is set even on an empty database, or SQLite would continue from a negative id.
+                    max_run_id = session.query(func.max(InfraAvailability.run_id)).scalar()
+                    run.id = max(max_run_id or 0, 0) + 1
+                session.add(run)
+                try:
+                    session.commit()
+                except IntegrityError:
+                    # Another collector seeded the table at the same moment; take the next identity value
+                    session.rollback()
+                    run = EtlRun(started_at=datetime.now(), status='running', instance_count=instance_count)
+                    session.add(run)
+                    session.commit()
+                logging.info(f"Allocated run_id {run.id}")
+                return run.id
         except Exception as e:
-            logging.error(f"Error getting new run ID: {str(e)}")
+            logging.error(f"Error allocating run ID: {str(e)}")
             raise
 
-    def insert_infra_availability(self, server_id, is_available):
+    @staticmethod
+    def _record_finish(session, run_id, instance_statuses: List[InstanceRunStatus], finished_at):
+        succeeded = sum(1 for status in instance_statuses if status['status'] == 'success')
+        partial = any(status['status'] == 'partial' for status in instance_statuses)
+        if succeeded == len(instance_statuses):
+            run_status = 'success'
+        elif succeeded or partial:
+            run_status = 'partial'
+        else:
+            run_status = 'failure'
+
+        if instance_statuses:
+            session.execute(insert(EtlRunInstance), [{
+                'run_id': run_id,
+                'plant_name': status['plant_name'],
+                'instance_url': status['url'],
+                'status': status['status'],
+                'started_at': status['started_at'],
+                'finished_at': status['finished_at'],
+                'rows_written': status['rows_written']
+            } for status in instance_statuses])
+        session.execute(update(EtlRun).where(EtlRun.id == run_id).values(
+            finished_at=finished_at,
+            status=run_status,
+            instance_count=len(instance_statuses),
+            rows_written=sum(status['rows_written'] for status in instance_statuses)))
+        logging.info(f"Recorded run {run_id} as {run_status} ({succeeded}/{len(instance_statuses)} instances)")
+
+    def finish_run(self, run_id, instance_statuses: List[InstanceRunStatus]):
         try:
             with self.Session() as session:
-                availability = InfraAvailability(
-                    server_id=server_id,
-                    timestamp=datetime.now(),
-                    is_available=is_available,
-                    run_id=self.run_id
-                )
-                session.add(availability)
+                self._record_finish(session, run_id, instance_statuses, datetime.now())
                 session.commit()
         except Exception as e:
-            logging.error(f"Error inserting availability data: {str(e)}")
+            logging.error(f"Error recording run {run_id}: {str(e)}")
             raise
 
-    def insert_disk_space(self, server_id, disk_data):
+    def _record_spooled_runs(self, session, run_rows):
+        # Runs started while the database was down (negative run ids, see DurableSink) reach etl_run
+        # through the spool: a row when the run started, and one with its instance statuses when it finished
+        for row in run_rows:
+            if session.get(EtlRun, row['run_id']) is None:
+                session.add(EtlRun(id=row['run_id'], started_at=row['timestamp'], status='running',
+                                   instance_count=row['instance_count']))
+                session.flush()
+            if row.get('instances') is not None:
+                instance_statuses = [{**status, 'started_at': datetime.fromisoformat(status['started_at']),
+                                      'finished_at': datetime.fromisoformat(status['finished_at'])}
+                                     for status in row['instances']]
+                self._record_finish(session, row['run_id'], instance_statuses,
+                                    datetime.fromisoformat(row['finished_at']))
+
+    @staticmethod
+    def _seed_disk_state_table(conn):
+        # One-off scan of fact_disk_space when the state table is created, so existing mounts are not
+        # all written again on the first run
+        latest = select(DiskSpace.server_id, DiskSpace.mount_point,
+                        func.max(DiskSpace.timestamp).label('timestamp')).group_by(
+            DiskSpace.server_id, DiskSpace.mount_point).subquery()
+        columns = ['server_id', 'mount_point', 'timestamp', 'total_space', 'used_space']
+        result = conn.execute(insert(DiskSpaceState.__table__).from_select(columns, select(
+            DiskSpace.server_id, DiskSpace.mount_point, DiskSpace.timestamp,
+            DiskSpace.total_space, DiskSpace.used_space).join(
+                latest, (DiskSpace.server_id == latest.c.server_id)
+                & (DiskSpace.mount_point == latest.c.mount_point)
+                & (DiskSpace.timestamp == latest.c.timestamp))))
+        logging.info(f"Seeded {DiskSpaceState.__tablename__} with {result.rowcount} mount points")
+
+    def _load_disk_state(self, server_ids):
+        # Reads the last stored values of servers not seen yet, a chunk of servers per query
+        with self._disk_state_lock:
+            server_ids = sorted(set(server_ids) - self._disk_state_servers)
+        if not server_ids:
+            return
         try:
+            states = {}
             with self.Session() as session:
-                disk_space = DiskSpace(
-                    server_id=server_id,
-                    timestamp=datetime.now(),
-                    mount_point=disk_data['mount_point'],
-                    total_space=disk_data['total_space'],
-                    used_space=disk_data['used_space'],
-                    free_space=disk_data['free_space'],
-                    free_space_percent=disk_data['free_space_percent']
-                )
-                session.add(disk_space)
+                for start in range(0, len(server_ids), self.batch_size):
+                    rows = session.execute(select(
+                        DiskSpaceState.server_id, DiskSpaceState.mount_point, DiskSpaceState.timestamp,
+                        DiskSpaceState.total_space, DiskSpaceState.used_space).where(
+                        DiskSpaceState.server_id.in_(server_ids[start:start + self.batch_size])))
+                    for row in rows:
+                        states[(row.server_id, row.mount_point)] = {
+                            'timestamp': row.timestamp, 'total_space': row.total_space, 'used_space': row.used_space}
+        except Exception as e:
+            logging.error(f"Error loading last disk space values: {str(e)}")
+            raise
+        with self._disk_state_lock:
+            for key, state in states.items():
+                # A value stored meanwhile by another flush is newer than the one just read
+                self._disk_state.setdefault(key, state)
+            self._disk_state_servers.update(server_ids)
+        logging.info(f"Loaded last disk space values for {len(states)} mount points of {len(server_ids)} servers")
+
+    def _disk_space_changed(self, last, row):
+        if row['total_space'] != last['total_space']:
+            return True
+        if not row['total_space']:
+            return row['used_space'] != last['used_space']
+        return abs(row['used_space'] - last['used_space']) / row['total_space'] * 100 >= self.dedup_threshold
+
+    def _filter_disk_space(self, rows):
+        # Returns the rows worth storing and the state they leave behind; the state is only applied
+        # once the rows are committed, so a failed write is retried against the old values
+        if not self.disk_space_dedup:
+            return rows, {}
+        self._load_disk_state(row['server_id'] for row in rows)
+        kept = []
+        updates = {}
+        with self._disk_state_lock:
+            for row in rows:
+                key = (row['server_id'], row['mount_point'])
+                last = updates.get(key) or self._disk_state.get(key)
+                if last is not None and row['timestamp'] < last['timestamp']:
+                    # Older than what is stored (backfill): keep it, but it says nothing about the current value
+                    kept.append(row)
+                elif (last is None or self._disk_space_changed(last, row)
+                      or row['timestamp'] - last['timestamp'] >= self.dedup_heartbeat):
+                    kept.append(row)
+                    updates[key] = {'timestamp': row['timestamp'], 'total_space': row['total_space'],
+                                    'used_space': row['used_space']}
+        DB_ROWS_DEDUPLICATED.inc(len(rows) - len(kept), table=DiskSpace.__tablename__)
+        return kept, updates
+
+    def _store_disk_state(self, session, updates):
+        # Replaces the state rows of the mounts that got a new fact row, in the same transaction as the facts
+        if not updates:
+            return
+        keys = [{'key_server_id': server_id, 'key_mount_point': mount_point} for server_id, mount_point in updates]
+        states = [{'server_id': server_id, 'mount_point': mount_point, **state}
+                  for (server_id, mount_point), state in updates.items()]
+        table = DiskSpaceState.__table__
+        connection = session.connection()
+        for start in range(0, len(keys), self.batch_size):
+            connection.execute(delete(table).where(
+                (table.c.server_id == bindparam('key_server_id'))
+                & (table.c.mount_point == bindparam('key_mount_point'))), keys[start:start + self.batch_size])
+            connection.execute(insert(table), states[start:start + self.batch_size])
+
+    def _apply_disk_state(self, updates):
+        with self._disk_state_lock:
+            self._disk_state.update(updates)
+
+    def get_disk_space_series(self, server_id, mount_point, time_from, time_till, interval=None):
+        # With change-only storage a value holds until the next stored row. This rebuilds that step
+        # function: the value in effect at time_from plus every change up to time_till, or, with an
+        # interval (timedelta), one point per step carrying the last known value forward.
+        try:
+            with self.Session() as session:
+                query = select(DiskSpace.timestamp, DiskSpace.total_space, DiskSpace.used_space,
+                               DiskSpace.free_space, DiskSpace.free_space_percent).where(
+                    DiskSpace.server_id == server_id, DiskSpace.mount_point == mount_point)
+                previous = session.execute(query.where(DiskSpace.timestamp <= time_from)
+                                           .order_by(DiskSpace.timestamp.desc()).limit(1)).first()
+                changes = session.execute(query.where(DiskSpace.timestamp > time_from,
+                                                      DiskSpace.timestamp <= time_till)
+                                          .order_by(DiskSpace.timestamp)).all()
+        except Exception as e:
+            logging.error(f"Error reading disk space series for server {server_id}, mount point {mount_point}: {str(e)}")
+            raise
+
+        points = [{**previous._asdict(), 'timestamp': time_from}] if previous else []
+        points.extend(row._asdict() for row in changes)
+        if interval is None:
+            return points
+
+        series = []
+        current = None
+        index = 0
+        step = time_from
+        while step <= time_till:
+            while index < len(points) and points[index]['timestamp'] <= step:
+                current = points[index]
+                index += 1
+            if current is not None:
+                series.append({**current, 'timestamp': step})
+            step += interval
+        return series
+
+    def queue_infra_availability(self, server_id, is_available, run_id=None, timestamp=None):
+        with self._buffer_lock:
+            self._availability_rows.append({
+                'server_id': server_id,
+                'timestamp': timestamp or datetime.now(),
+                'is_available': is_available,
+                'run_id': run_id
+            })
+            buffer_full = len(self._availability_rows) >= self.batch_size
+        if buffer_full:
+            self.flush()
+
+    def queue_disk_space(self, server_id, disk_data):
+        with self._buffer_lock:
+            self._disk_space_rows.append({
+                'server_id': server_id,
+                'timestamp': disk_data.get('timestamp') or datetime.now(),
+                'mount_point': disk_data['mount_point'],
+                'total_space': disk_data['total_space'],
+                'used_space': disk_data['used_space'],
+                'free_space': disk_data['free_space'],
+                'free_space_percent': disk_data['free_space_percent']
+            })
+            buffer_full = len(self._disk_space_rows) >= self.batch_size
+        if buffer_full:
+            self.flush()
+
+    def queue_host_metric(self, server_id, metric_data, run_id=None):
+        with self._buffer_lock:
+            self._host_metric_rows.append({
+                'server_id': server_id,
+                'timestamp': metric_data.get('timestamp') or datetime.now(),
+                'metric': metric_data['metric'],
+                'instance': metric_data['instance'],
+                'value': metric_data['value'],
+                'run_id': run_id
+            })
+            buffer_full = len(self._host_metric_rows) >= self.batch_size
+        if buffer_full:
+            self.flush()
+
+    def resolve_fact_rows(self, availability_rows, disk_space_rows, host_metric_rows=()):
+        # Turns plant/server-keyed rows (spool files, write-ahead spool) into fact table records
+        servers_by_plant = defaultdict(dict)
+        for row in [*availability_rows, *disk_space_rows, *host_metric_rows]:
+            servers_by_plant[row['plant_name']][row['zabbix_hostid']] = ServerInfo(
+                name=row['server_name'], hostid=row['zabbix_hostid'])
+
+        server_ids = {}
+        for plant_name, servers in servers_by_plant.items():
+            plant_id = self.get_plant_id(plant_name)
+            if plant_id is None:
+                raise ValueError(f"Plant {plant_name} not found in the database.")
+            for hostid, server_id in self.resolve_servers(plant_id, list(servers.values())).items():
+                server_ids[(plant_name, hostid)] = server_id
+
+        availability_records = [{
+            'server_id': server_ids[(row['plant_name'], row['zabbix_hostid'])],
+            'timestamp': row['timestamp'],
+            'is_available': row['is_available'],
+            'run_id': row['run_id']
+        } for row in availability_rows]
+        disk_space_records = [{
+            'server_id': server_ids[(row['plant_name'], row['zabbix_hostid'])],
+            'timestamp': row['timestamp'],
+            'mount_point': row['mount_point'],
+            'total_space': row['total_space'],
+            'used_space': row['used_space'],
+            'free_space': row['free_space'],
+            'free_space_percent': row['free_space_percent']
+        } for row in disk_space_rows]
+        host_metric_records = [{
+            'server_id': server_ids[(row['plant_name'], row['zabbix_hostid'])],
+            'timestamp': row['timestamp'],
+            'metric': row['metric'],
+            'instance': row['instance'],
+            'value': row['value'],
+            'run_id': row['run_id']
+        } for row in host_metric_rows]
+        return availability_records, disk_space_records, host_metric_records
+
+    def _insert_facts(self, session, availability_rows, disk_space_rows, host_metric_rows):
+        for model, rows in ((InfraAvailability, availability_rows), (DiskSpace, disk_space_rows),
+                            (HostMetric, host_metric_rows)):
+            for start in range(0, len(rows), self.batch_size):
+                session.execute(insert(model), rows[start:start + self.batch_size])
+
+    def _count_written(self, availability_rows, disk_space_rows, host_metric_rows):
+        DB_ROWS_WRITTEN.inc(len(availability_rows), table=InfraAvailability.__tablename__)
+        DB_ROWS_WRITTEN.inc(len(disk_space_rows), table=DiskSpace.__tablename__)
+        DB_ROWS_WRITTEN.inc(len(host_metric_rows), table=HostMetric.__tablename__)
+
+    def write_fact_batch(self, batch_key, availability_rows, disk_space_rows, host_metric_rows=(), run_rows=()):
+        # Idempotent bulk load: the batch key is recorded in the same transaction as the facts,
+        # so replaying a batch that already made it in is a no-op
+        try:
+            with self.Session() as session:
+                if session.query(SpoolBatch.id).filter_by(batch_key=batch_key).first():
+                    logging.info(f"Batch {batch_key} was already loaded, skipping")
+                    return False
+
+            availability_records, disk_space_records, host_metric_records = self.resolve_fact_rows(
+                availability_rows, disk_space_rows, host_metric_rows)
+            disk_space_records, disk_state = self._filter_disk_space(disk_space_records)
+
+            with DB_OPERATION_SECONDS.time(operation='write_fact_batch'), self.Session() as session:
+                self._record_spooled_runs(session, run_rows)
+                self._insert_facts(session, availability_records, disk_space_records, host_metric_records)
+                self._store_disk_state(session, disk_state)
+                session.add(SpoolBatch(batch_key=batch_key, loaded_at=datetime.now(),
+                                       row_count=len(availability_records) + len(disk_space_records) + len(host_metric_records)))
                 session.commit()
+            self._apply_disk_state(disk_state)
+            self._count_written(availability_records, disk_space_records, host_metric_records)
+            logging.info(f"Loaded batch {batch_key}: {len(availability_records)} availability rows, {len(disk_space_records)} disk space rows "
+                         f"and {len(host_metric_records)} host metric rows")
+            return True
         except Exception as e:
-            logging.error(f"Error inserting disk data: {str(e)}")
+            logging.error(f"Error loading batch {batch_key}: {str(e)}")
             raise
 
+    def flush(self):
+        # Swap the buffers out under the lock so rows queued during the write land in the next batch
+        with self._buffer_lock:
+            availability_rows, self._availability_rows = self._availability_rows, []
+            disk_space_rows, self._disk_space_rows = self._disk_space_rows, []
+            host_metric_rows, self._host_metric_rows = self._host_metric_rows, []
+
+        if not availability_rows and not disk_space_rows and not host_metric_rows:
+            return 0
+
+        try:
+            disk_space_rows, disk_state = self._filter_disk_space(disk_space_rows)
+            with DB_OPERATION_SECONDS.time(operation='flush'), self.Session() as session:
+                self._insert_facts(session, availability_rows, disk_space_rows, host_metric_rows)
+                self._store_disk_state(session, disk_state)
+                session.commit()
+            self._apply_disk_state(disk_state)
+            self._count_written(availability_rows, disk_space_rows, host_metric_rows)
+            logging.info(f"Flushed {len(availability_rows)} availability rows, {len(disk_space_rows)} disk space rows "
+                         f"and {len(host_metric_rows)} host metric rows")
+            return len(availability_rows) + len(disk_space_rows) + len(host_metric_rows)
+        except Exception as e:
+            logging.error(f"Error flushing buffered fact rows: {str(e)}")
+            raise
@@ -0,0 +1,58 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+from database_manager import DatabaseManager
+from zabbix_types import HostData, InstanceRunStatus, ServerInfo
+
+
+class DatabaseWriter:
+    def __init__(self, db_manager: DatabaseManager):
+        self.db_manager = db_manager
+        # A single worker keeps blocking pyodbc calls off the event loop and serializes all DB access
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    async def get_plant_id(self, plant_name):
+        return await self._run(self.db_manager.get_plant_id, plant_name)
+
+    async def get_or_create_server(self, plant_id, server_name, zabbix_hostid=None):
+        return await self._run(self.db_manager.get_or_create_server, plant_id, server_name, zabbix_hostid)
+
+    async def resolve_servers(self, plant_id, servers: List[ServerInfo]) -> Dict[str, int]:
+        return await self._run(self.db_manager.resolve_servers, plant_id, servers)
+
+    async def allocate_run_id(self, instance_count=None):
+        return await self._run(self.db_manager.allocate_run_id, instance_count)
+
+    async def finish_run(self, run_id, instance_statuses: List[InstanceRunStatus]):
+        return await self._run(self.db_manager.finish_run, run_id, instance_statuses)
+
+    async def queue_host_data(self, server_id, host_data: HostData, run_id=None):
+        def queue():
+            self.db_manager.queue_infra_availability(server_id, host_data['is_available'], run_id, host_data['timestamp'])
+            for disk_data in host_data['disk_space']:
+                self.db_manager.queue_disk_space(server_id, disk_data)
+            for metric_data in host_data['metrics']:
+                self.db_manager.queue_host_metric(server_id, metric_data, run_id)
+
+        await self._run(queue)
+
+    async def drain(self, aggregator, run_id):
+        # Queue an aggregator's rows and write them out in one executor hop
+        def drain_and_flush():
+            rows = aggregator.drain(self.db_manager, run_id)
+            self.db_manager.flush()
+            return rows
+
+        return await self._run(drain_and_flush)
+
+    async def flush(self):
+        return await self._run(self.db_manager.flush)
+
+    def close(self):
+        logging.info("Shutting down database writer")
+        self.executor.shutdown(wait=True)
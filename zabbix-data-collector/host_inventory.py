@@ -0,0 +1,129 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from metrics import INVENTORY_REFRESHES
+from zabbix_types import ServerInfo
+
+
+def diff_snapshots(previous: Optional[dict], current: dict) -> Dict[str, int]:
+    previous_hosts = previous['hosts'] if previous else {}
+    previous_items = previous['items'] if previous else {}
+    old_itemids = {itemid for itemids in previous_items.values() for itemid in itemids}
+    new_itemids = {itemid for itemids in current['items'].values() for itemid in itemids}
+    return {
+        'hosts_added': len(current['hosts'].keys() - previous_hosts.keys()),
+        'hosts_removed': len(previous_hosts.keys() - current['hosts'].keys()),
+        'hosts_renamed': sum(1 for hostid, name in current['hosts'].items()
+                             if hostid in previous_hosts and previous_hosts[hostid] != name),
+        'items_added': len(new_itemids - old_itemids),
+        'items_removed': len(old_itemids - new_itemids),
+    }
+
+
+class HostInventory:
+    # Per-plant cache of the monitored hosts and the ids of their collected items. Runs inside the TTL skip
+    # hostgroup.get/host.get and fetch item values by itemid; a stale snapshot is still used for the current
+    # run while its replacement is fetched alongside the collection.
+    def __init__(self, path: Optional[str], ttl: float = 3600):
+        # Without a path the inventory only lives in memory (daemon cycles, sharded workers)
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # plant name -> {'refreshed_at', 'url', 'username', 'host_groups', 'groups': {groupid: name},
+        #                'hosts': {hostid: name}, 'items': {hostid: [itemid, ...]}}
+        # Keyed by plant rather than url: plants sharing a frontend may list different groups or log in
+        # as users with different permissions
+        self.snapshots: Dict[str, dict] = {}
+        self.refreshing: Dict[str, asyncio.Task] = {}
+        if path is not None:
+            self.load()
+
+    def load(self) -> None:
+        if not os.path.exists(self.path):
+            logging.info(f"No host inventory file at {self.path}, hosts are fetched on the first run")
+            return
+        try:
+            with open(self.path, 'r') as file:
+                self.snapshots = json.load(file)
+            logging.info(f"Loaded host inventory for {len(self.snapshots)} plants from {self.path}")
+        except Exception as e:
+            logging.error(f"Error loading host inventory from {self.path}, starting empty: {str(e)}")
+            self.snapshots = {}
+
+    def get(self, plant_name: str) -> Optional[dict]:
+        with self.lock:
+            return self.snapshots.get(plant_name)
+
+    def set(self, plant_name: str, snapshot: dict) -> None:
+        with self.lock:
+            self.snapshots[plant_name] = snapshot
+
+    def save(self) -> None:
+        if self.path is None:
+            return
+        with self.lock:
+            data = json.dumps(self.snapshots)
+            # Write to a temp file first so a crash never leaves a truncated inventory behind
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as file:
+                file.write(data)
+            os.replace(tmp_path, self.path)
+
+    async def refresh(self, plant_name: str, zabbix_collector) -> dict:
+        try:
+            snapshot = await zabbix_collector.get_inventory()
+        except Exception:
+            INVENTORY_REFRESHES.inc(instance=zabbix_collector.metrics_label, result='failure')
+            raise
+        previous = self.get(plant_name)
+        self.set(plant_name, snapshot)
+        changes = diff_snapshots(previous, snapshot)
+        INVENTORY_REFRESHES.inc(instance=zabbix_collector.metrics_label,
+                                result='changed' if any(changes.values()) else 'unchanged')
+        if previous is None:
+            logging.info(f"Fetched host inventory for {plant_name}: {len(snapshot['hosts'])} hosts, "
+                         f"{sum(len(itemids) for itemids in snapshot['items'].values())} items")
+        elif any(changes.values()):
+            logging.info(f"Host inventory for {plant_name} changed: " + ', '.join(
+                f"{count} {change.replace('_', ' ')}" for change, count in changes.items() if count))
+        else:
+            logging.info(f"Host inventory for {plant_name} is unchanged")
+        return snapshot
+
+    async def _refresh_in_background(self, plant_name: str, zabbix_collector) -> None:
+        try:
+            await self.refresh(plant_name, zabbix_collector)
+        except Exception as e:
+            logging.warning(f"Background host inventory refresh for {plant_name} failed, keeping the cached hosts: {str(e)}")
+        finally:
+            self.refreshing.pop(plant_name, None)
+
+    async def snapshot(self, plant_name: str, zabbix_collector) -> Tuple[dict, Optional[asyncio.Task]]:
+        # Returns the snapshot to collect with, and the background refresh the caller must await before
+        # its collector goes away
+        current = self.get(plant_name)
+        # Listed with other settings or credentials: refresh before collecting
+        if (current is None or current.get('url') != zabbix_collector.instance['url']
+                or current.get('username') != zabbix_collector.instance.get('username')
+                or current.get('host_groups') != zabbix_collector.host_groups):
+            return await self.refresh(plant_name, zabbix_collector), None
+        if time.time() - current['refreshed_at'] < self.ttl or plant_name in self.refreshing:
+            return current, None
+        task = self.refreshing[plant_name] = asyncio.create_task(self._refresh_in_background(plant_name, zabbix_collector))
+        return current, task
+
+    @staticmethod
+    def servers(snapshot: dict) -> List[ServerInfo]:
+        return [ServerInfo(name=name, hostid=hostid) for hostid, name in snapshot['hosts'].items()]
+
+
+def create_host_inventory(config: dict, persistent: bool = True) -> Optional[HostInventory]:
+    inventory_config = config.get('host_inventory') or {}
+    if not inventory_config.get('enabled', False):
+        return None
+    return HostInventory(inventory_config.get('file') if persistent else None,
+                         float(inventory_config.get('ttl', 3600)))
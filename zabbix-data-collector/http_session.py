@@ -0,0 +1,33 @@
+import aiohttp
+import json
+import logging
+from typing import Optional
+
+# orjson is optional; it parses the multi-megabyte item.get responses of large plants several times faster
+try:
+    import orjson
+    json_loads = orjson.loads
+    JSON_DECODER = 'orjson'
+except ImportError:
+    json_loads = json.loads
+    JSON_DECODER = 'json'
+
+
+def create_http_session(http_config: Optional[dict] = None) -> aiohttp.ClientSession:
+    # One pooled session is shared by login, collection and logout so TCP/TLS connections get reused
+    http_config = http_config or {}
+    connector = aiohttp.TCPConnector(
+        limit=int(http_config.get('connection_limit', 100)),
+        limit_per_host=int(http_config.get('connection_limit_per_host', 20)),
+        keepalive_timeout=float(http_config.get('keepalive_timeout', 60)),
+        use_dns_cache=True,
+        ttl_dns_cache=int(http_config.get('dns_cache_ttl', 300)),
+        ssl=None if http_config.get('verify_ssl', True) else False
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=float(http_config.get('timeout', 120)),
+        connect=float(http_config.get('connect_timeout', 15))
+    )
+    logging.info(f"Created shared HTTP session with per-host connection limit {connector.limit_per_host} "
+                 f"and the {JSON_DECODER} decoder")
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
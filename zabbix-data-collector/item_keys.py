@@ -0,0 +1,90 @@
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+# name[param,...]; the parameter list is split by PARAM_PATTERN since quoted parameters may hold commas and brackets
+KEY_PATTERN = re.compile(r'([^\[\]]+)(?:\[(.*)\])?', re.DOTALL)
+PARAM_PATTERN = re.compile(r'\s*(?:"((?:[^"\\]|\\.)*)"|([^",]*?))\s*(,|$)', re.DOTALL)
+
+# vfs.fs.size[fs,<mode>] mode -> disk space field; Zabbix defaults the mode to total
+DISK_SPACE_MODES = {
+    'total': 'total_space',
+    'used': 'used_space',
+    'free': 'free_space',
+    'pfree': 'free_space_percent',
+    'pused': 'used_space_percent',
+}
+
+# Items stored in fact_host_metric, collected in the same item.get as availability and disk space.
+# Keyed by (item key name, parameters); a '*' parameter matches any value and becomes the row's instance
+# (e.g. the mount point). Parameters are compared as written, ignoring trailing empty ones.
+HOST_METRIC_ITEMS: Dict[Tuple[str, Tuple[str, ...]], str] = {
+    ('system.cpu.util', ()): 'cpu_util_percent',
+    ('system.cpu.load', ('all', 'avg1')): 'cpu_load_avg1',
+    ('system.cpu.load', ('all', 'avg5')): 'cpu_load_avg5',
+    ('vm.memory.size', ('total',)): 'memory_total_bytes',
+    ('vm.memory.size', ('available',)): 'memory_available_bytes',
+    ('vm.memory.size', ('pavailable',)): 'memory_available_percent',
+    ('vfs.fs.inode', ('*', 'pfree')): 'inode_free_percent',
+}
+
+
+@lru_cache(maxsize=65536)
+def parse_item_key(key: str) -> Optional[Tuple[str, Tuple[str, ...]]]:
+    # 'vfs.fs.size["C:",pfree]' -> ('vfs.fs.size', ('C:', 'pfree')); None for a malformed key
+    match = KEY_PATTERN.fullmatch(key)
+    if match is None:
+        return None
+    name, raw_params = match.groups()
+    if raw_params is None:
+        return name, ()
+
+    params = []
+    pos = 0
+    while True:
+        param = PARAM_PATTERN.match(raw_params, pos)
+        if param is None:
+            return None
+        quoted, plain, separator = param.groups()
+        params.append(quoted.replace('\\"', '"') if quoted is not None else plain)
+        if not separator:
+            return name, tuple(params)
+        pos = param.end()
+
+
+@lru_cache(maxsize=65536)
+def disk_item_field(key: str) -> Optional[Tuple[str, str]]:
+    # 'vfs.fs.size[/var,free]' -> ('/var', 'free_space'); None for other keys and unknown modes
+    parsed = parse_item_key(key)
+    if parsed is None or parsed[0] != 'vfs.fs.size' or not parsed[1] or not parsed[1][0]:
+        return None
+    params = parsed[1]
+    field = DISK_SPACE_MODES.get(params[1] if len(params) > 1 and params[1] else 'total')
+    return (params[0], field) if field else None
+
+
+@lru_cache(maxsize=65536)
+def host_metric(key: str) -> Optional[Tuple[str, Optional[str]]]:
+    # 'vfs.fs.inode[/,pfree]' -> ('inode_free_percent', '/'); None for keys not in HOST_METRIC_ITEMS
+    parsed = parse_item_key(key)
+    if parsed is None:
+        return None
+    name, params = parsed
+    while params and params[-1] == '':
+        params = params[:-1]
+    for (item_name, pattern), metric in HOST_METRIC_ITEMS.items():
+        if item_name != name or len(pattern) != len(params):
+            continue
+        if all(expected in ('*', actual) for expected, actual in zip(pattern, params)):
+            return metric, next((actual for expected, actual in zip(pattern, params) if expected == '*'), None)
+    return None
+
+
+def host_metric_search_patterns() -> List[str]:
+    # item.get search patterns (wildcards enabled) covering every key in HOST_METRIC_ITEMS
+    patterns = []
+    for name, params in HOST_METRIC_ITEMS:
+        pattern = f"{name}[*" if params else name
+        if pattern not in patterns:
+            patterns.append(pattern)
+    return patterns
@@ -0,0 +1,54 @@
+import json
+import logging
+import os
+import threading
+from typing import Dict, Optional
+
+
+class ItemStateStore:
+    def __init__(self, path: Optional[str]):
+        # Without a path the store only lives in memory (sharded workers hand their clocks to the parent)
+        self.path = path
+        self.lock = threading.Lock()
+        # instance url -> itemid -> last lastclock written to the database
+        self.clocks: Dict[str, Dict[str, int]] = {}
+        if path is not None:
+            self.load()
+
+    def load(self) -> None:
+        if not os.path.exists(self.path):
+            logging.info(f"No item state file at {self.path}, starting with empty state")
+            return
+        try:
+            with open(self.path, 'r') as file:
+                self.clocks = json.load(file)
+            logging.info(f"Loaded item state for {sum(len(c) for c in self.clocks.values())} items from {self.path}")
+        except Exception as e:
+            logging.error(f"Error loading item state from {self.path}, starting with empty state: {str(e)}")
+            self.clocks = {}
+
+    def get_clocks(self, url: str) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.clocks.get(url, {}))
+
+    def update(self, url: str, clocks: Dict[str, int]) -> None:
+        with self.lock:
+            self.clocks.setdefault(url, {}).update(clocks)
+
+    def save(self) -> None:
+        if self.path is None:
+            return
+        with self.lock:
+            data = json.dumps(self.clocks)
+            # Write to a temp file first so a crash never leaves a truncated state file behind
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as file:
+                file.write(data)
+            os.replace(tmp_path, self.path)
+
+
+def create_item_state(config: dict) -> Optional[ItemStateStore]:
+    incremental = config.get('incremental') or {}
+    if not incremental.get('enabled', False):
+        return None
+    return ItemStateStore(incremental.get('state_file', 'item_state.json'))
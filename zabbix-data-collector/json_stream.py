@@ -0,0 +1,105 @@
+import codecs
+import json
+from typing import AsyncIterator, Optional
+import aiohttp
+
+WHITESPACE = ' \t\r\n'
+DELIMITERS = WHITESPACE + ',]}'
+
+
+class JsonRpcError(Exception):
+    def __init__(self, error: dict):
+        super().__init__(error.get('data') or error.get('message') or 'JSON-RPC error')
+        self.error = error
+
+
+class StreamParser:
+    # Pulls JSON values off an aiohttp stream with raw_decode, keeping only the undecoded tail in memory
+    def __init__(self, content: aiohttp.StreamReader, chunk_size: int):
+        self.content = content
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    async def _fill(self) -> None:
+        if self.eof:
+            raise ValueError("Unexpected end of JSON-RPC response")
+        chunk = await self.content.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            self.buffer = self.buffer[self.pos:] + self.text_decoder.decode(b'', final=True)
+        else:
+            # Dropping the consumed prefix here keeps the buffer at roughly one chunk plus one value
+            self.buffer = self.buffer[self.pos:] + self.text_decoder.decode(chunk)
+        self.pos = 0
+
+    async def peek(self) -> str:
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            await self._fill()
+
+    async def expect(self, char: str) -> None:
+        if await self.peek() != char:
+            raise ValueError(f"Expected '{char}' in JSON-RPC response, got '{self.buffer[self.pos]}'")
+        self.pos += 1
+
+    async def value(self):
+        await self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A number is only complete once a delimiter follows; "-1." may still become "-1.5e3"
+                if self.eof or (end < len(self.buffer) and (
+                        not isinstance(value, (int, float)) or self.buffer[end] in DELIMITERS)):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            await self._fill()
+
+
+async def iter_result(response: aiohttp.ClientResponse, chunk_size: int = 65536) -> AsyncIterator[dict]:
+    # Yields the elements of a JSON-RPC response's "result" array one at a time. Other members are
+    # decoded whole; an "error" member is raised as JsonRpcError once the object has been read.
+    parser = StreamParser(response.content, chunk_size)
+    error: Optional[dict] = None
+    await parser.expect('{')
+    if await parser.peek() == '}':
+        return
+    while True:
+        key = await parser.value()
+        await parser.expect(':')
+        if key == 'result' and await parser.peek() == '[':
+            parser.pos += 1
+            if await parser.peek() == ']':
+                parser.pos += 1
+            else:
+                while True:
+                    yield await parser.value()
+                    separator = await parser.peek()
+                    parser.pos += 1
+                    if separator == ']':
+                        break
+                    if separator != ',':
+                        raise ValueError(f"Expected ',' or ']' in result array, got '{separator}'")
+        else:
+            value = await parser.value()
+            if key == 'error':
+                error = value
+
+        separator = await parser.peek()
+        parser.pos += 1
+        if separator == '}':
+            break
+        if separator != ',':
+            raise ValueError(f"Expected ',' or '}}' in JSON-RPC response, got '{separator}'")
+
+    if error is not None:
+        raise JsonRpcError(error)
@@ -0,0 +1,218 @@
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Tuple
+from aiohttp import web
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class Metric:
+    kind = ''
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str], lock: threading.Lock):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.lock = lock
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def _format_labels(self, key: Tuple[str, ...], extra: str = '') -> str:
+        pairs = [f'{name}="{self._escape(value)}"' for name, value in zip(self.labelnames, key)]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    @staticmethod
+    def _escape(value: str) -> str:
+        return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{self._format_labels(key)} {value}" for key, value in sorted(self.values.items())]
+
+    def merge(self, values: Dict[Tuple[str, ...], float]) -> None:
+        with self.lock:
+            for key, value in values.items():
+                self.values[key] = self.values.get(key, 0) + value
+
+    def summary(self) -> List[str]:
+        return [f"{self.name}{self._format_labels(key)}: {value:g}" for key, value in sorted(self.values.items())]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, *args, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(*args)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts..., +Inf count, sum, max]
+        self.values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0.0]
+            state[bisect.bisect_left(self.buckets, value)] += 1
+            state[-2] += value
+            state[-1] = max(state[-1], value)
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def merge(self, values: Dict[Tuple[str, ...], List[float]]) -> None:
+        with self.lock:
+            for key, other in values.items():
+                state = self.values.get(key)
+                if state is None:
+                    self.values[key] = list(other)
+                    continue
+                for i in range(len(state) - 1):
+                    state[i] += other[i]
+                state[-1] = max(state[-1], other[-1])
+
+    def render(self) -> List[str]:
+        lines = []
+        for key, state in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                bucket_labels = self._format_labels(key, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            count = cumulative + state[len(self.buckets)]
+            bucket_labels = self._format_labels(key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{bucket_labels} {count}")
+            lines.append(f"{self.name}_sum{self._format_labels(key)} {state[-2]}")
+            lines.append(f"{self.name}_count{self._format_labels(key)} {count}")
+        return lines
+
+    def summary(self) -> List[str]:
+        lines = []
+        for key, state in sorted(self.values.items()):
+            count = sum(state[:len(self.buckets) + 1])
+            lines.append(f"{self.name}{self._format_labels(key)}: count={count} total={state[-2]:.3f}s "
+                         f"avg={state[-2] / count:.3f}s max={state[-1]:.3f}s")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics: List[Metric] = []
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, help_text, labelnames, self.lock)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help_text, labelnames, self.lock, buckets=buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        with self.lock:
+            for metric in self.metrics:
+                lines.append(f"# HELP {metric.name} {metric.help_text}")
+                lines.append(f"# TYPE {metric.name} {metric.kind}")
+                lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self) -> Dict[str, dict]:
+        # Plain, picklable copy of every value so another process can merge it
+        with self.lock:
+            return {metric.name: {key: value if isinstance(value, (int, float)) else list(value)
+                                  for key, value in metric.values.items()} for metric in self.metrics}
+
+    def clear(self) -> None:
+        with self.lock:
+            for metric in self.metrics:
+                metric.values.clear()
+
+    def merge(self, snapshot: Dict[str, dict]) -> None:
+        for metric in self.metrics:
+            if metric.name in snapshot:
+                metric.merge(snapshot[metric.name])
+
+    def log_summary(self) -> None:
+        with self.lock:
+            lines = [line for metric in self.metrics for line in metric.summary()]
+        logging.info("Run metrics summary:")
+        for line in lines:
+            logging.info(f"  {line}")
+
+
+REGISTRY = MetricsRegistry()
+
+API_REQUEST_SECONDS = REGISTRY.histogram(
+    'zabbix_api_request_seconds', 'Duration of Zabbix API HTTP requests', ['instance', 'method'])
+API_REQUEST_ERRORS = REGISTRY.counter(
+    'zabbix_api_request_errors_total', 'Zabbix API requests that failed or returned a JSON-RPC error',
+    ['instance', 'method'])
+API_REQUEST_RETRIES = REGISTRY.counter(
+    'zabbix_api_request_retries_total', 'Zabbix API requests retried after a connection error', ['instance'])
+DB_OPERATION_SECONDS = REGISTRY.histogram(
+    'db_operation_seconds', 'Duration of DatabaseManager writes', ['operation'])
+DB_ROWS_WRITTEN = REGISTRY.counter(
+    'db_rows_written_total', 'Rows written to the database', ['table'])
+INSTANCE_RUN_SECONDS = REGISTRY.histogram(
+    'instance_run_seconds', 'Duration of a full collection run for one Zabbix instance', ['instance'])
+INSTANCE_RUNS = REGISTRY.counter(
+    'instance_runs_total', 'Collection runs per Zabbix instance by result', ['instance', 'status'])
+SPOOL_BATCHES = REGISTRY.counter(
+    'spool_batches_total', 'Write-ahead spool batches drained to the database by result', ['status'])
+API_CIRCUIT_OPENS = REGISTRY.counter(
+    'zabbix_api_circuit_opens_total', 'Times the circuit breaker for a Zabbix instance opened', ['instance'])
+API_REQUESTS_REJECTED = REGISTRY.counter(
+    'zabbix_api_requests_rejected_total', 'Zabbix API requests failed fast by an open circuit', ['instance'])
+DB_ROWS_DEDUPLICATED = REGISTRY.counter(
+    'db_rows_deduplicated_total', 'Fact rows not written because the value had not changed', ['table'])
+INVENTORY_REFRESHES = REGISTRY.counter(
+    'host_inventory_refreshes_total', 'Host inventory refreshes per Zabbix instance by result', ['instance', 'result'])
+STARTUP_SECONDS = REGISTRY.histogram(
+    'startup_seconds', 'Time from process start (module imports included) until collection begins', ['command'])
+
+
+async def start_metrics_server(metrics_config: Optional[dict]) -> Optional[web.AppRunner]:
+    metrics_config = metrics_config or {}
+    if not metrics_config.get('enabled', False):
+        return None
+
+    async def handle_metrics(request: web.Request) -> web.Response:
+        return web.Response(text=REGISTRY.render(), content_type='text/plain', charset='utf-8',
+                            headers={'X-Prometheus-Format': '0.0.4'})
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    host = metrics_config.get('host', '127.0.0.1')
+    port = int(metrics_config.get('port', 9108))
+    await web.TCPSite(runner, host, port).start()
+    logging.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,188 @@
+import argparse
+import asyncio
+import fnmatch
+import logging
+import random
+import time
+from collections import Counter
+from typing import List, Optional
+from aiohttp import web
+
+MOUNT_FIELDS = ['total', 'used', 'free']
+HOST_METRIC_KEYS = ['system.cpu.util', 'system.cpu.load[all,avg1]', 'vm.memory.size[pavailable]']
+HOST_GROUPS = {'1': 'Servers', '2': 'Databases'}
+
+
+class MockZabbixServer:
+    # Stand-in for a Zabbix frontend's api_jsonrpc.php, used by benchmark.py
+    def __init__(self, hosts: int = 100, mounts_per_host: int = 3, latency: float = 0.0,
+                 error_rate: float = 0.0, supports_batch: bool = True, seed: int = 42):
+        self.hosts = hosts
+        self.mounts_per_host = mounts_per_host
+        self.latency = latency
+        self.error_rate = error_rate
+        self.supports_batch = supports_batch
+        self.random = random.Random(seed)
+        self.http_requests = 0
+        self.calls = Counter()
+        self.errors = 0
+        self.runner: Optional[web.AppRunner] = None
+
+    def host_items(self, hostid: str) -> List[dict]:
+        clock = str(int(time.time()) // 60 * 60)
+        index = int(hostid) - 10000
+        items = [{
+            'itemid': f"{hostid}000", 'hostid': hostid, 'key_': 'agent.ping', 'name': 'Zabbix agent ping',
+            'lastvalue': '0' if index % 50 == 49 else '1', 'lastclock': clock, 'value_type': '3'
+        }]
+        # Every tenth host looks like a Windows agent, whose drive letters are quoted in item keys
+        windows = index % 10 == 9
+        for mount in range(self.mounts_per_host):
+            if windows:
+                mount_point = f"{chr(ord('C') + mount)}:"
+            else:
+                mount_point = '/' if mount == 0 else f"/data{mount}"
+            total = 100 * 1024 ** 3 * (mount + 1)
+            used = total * ((index * 7 + mount * 13) % 90 + 5) // 100
+            values = {'total': total, 'used': used, 'free': total - used}
+            for field_index, field in enumerate(MOUNT_FIELDS):
+                items.append({
+                    'itemid': f"{hostid}{mount + 1:02d}{field_index}", 'hostid': hostid,
+                    'key_': f'vfs.fs.size["{mount_point}",{field}]' if windows else f"vfs.fs.size[{mount_point},{field}]",
+                    'name': f"{mount_point}: {field} space",
+                    'lastvalue': str(values[field]), 'lastclock': clock, 'value_type': '3'
+                })
+        for metric_index, key in enumerate(HOST_METRIC_KEYS):
+            items.append({
+                'itemid': f"{hostid}99{metric_index}", 'hostid': hostid, 'key_': key, 'name': key,
+                'lastvalue': str(round((index * 11 + metric_index * 17) % 100 / 3, 4)), 'lastclock': clock,
+                'value_type': '0'
+            })
+        return items
+
+    @staticmethod
+    def _matches(value: str, patterns, wildcards: bool) -> bool:
+        if isinstance(patterns, str):
+            patterns = [patterns]
+        if wildcards:
+            return any(fnmatch.fnmatchcase(value, pattern) for pattern in patterns)
+        return any(pattern in value for pattern in patterns)
+
+    def _select_items(self, params: dict) -> List[dict]:
+        if 'itemids' in params:
+            itemids = set(params['itemids'])
+            hostids = sorted({itemid[:5] for itemid in itemids})
+            items = [item for hostid in hostids for item in self.host_items(hostid) if item['itemid'] in itemids]
+        else:
+            items = [item for hostid in params.get('hostids', []) for item in self.host_items(hostid)]
+
+        for field, values in (params.get('filter') or {}).items():
+            values = values if isinstance(values, list) else [values]
+            items = [item for item in items if item.get(field) in values]
+        for field, patterns in (params.get('search') or {}).items():
+            items = [item for item in items
+                     if self._matches(item.get(field, ''), patterns, params.get('searchWildcardsEnabled', False))]
+        return items
+
+    def _history(self, params: dict) -> List[dict]:
+        records = []
+        items = {item['itemid']: item for item in self._select_items({'itemids': params['itemids']})}
+        for clock in range(int(params['time_from']) // 60 * 60, int(params['time_till']) + 1, 60):
+            for itemid, item in items.items():
+                record = {'itemid': itemid, 'clock': str(clock)}
+                if params.get('_trends'):
+                    record.update({'num': '60', 'value_min': item['lastvalue'], 'value_avg': item['lastvalue'],
+                                   'value_max': item['lastvalue']})
+                else:
+                    record.update({'value': item['lastvalue'], 'ns': '0'})
+                records.append(record)
+        return records
+
+    @staticmethod
+    def _project(rows: List[dict], output) -> List[dict]:
+        if isinstance(output, list):
+            return [{field: row[field] for field in output if field in row} for row in rows]
+        return rows
+
+    def handle_call(self, call: dict) -> dict:
+        method = call.get('method')
+        params = call.get('params') or {}
+        self.calls[method] += 1
+
+        if method == 'user.login':
+            result = 'mock-session-token'
+        elif method == 'user.logout':
+            result = True
+        elif method == 'hostgroup.get':
+            names = (params.get('filter') or {}).get('name')
+            result = [{'groupid': groupid, 'name': name} for groupid, name in HOST_GROUPS.items()
+                      if names is None or name in names]
+        elif method == 'host.get':
+            # Every mock host is in the Servers group
+            in_group = '1' in params.get('groupids', ['1'])
+            result = [{'hostid': str(10000 + index), 'name': f"server-{index:05d}"}
+                      for index in range(self.hosts if in_group else 0)]
+        elif method == 'item.get':
+            result = self._select_items(params)
+        elif method == 'history.get':
+            result = self._history(params)
+        elif method == 'trend.get':
+            result = self._history({**params, '_trends': True})
+        else:
+            return {'jsonrpc': '2.0', 'error': {'code': -32601, 'message': 'Method not found.', 'data': method},
+                    'id': call.get('id')}
+        return {'jsonrpc': '2.0', 'result': self._project(result, params.get('output')), 'id': call.get('id')}
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.http_requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.errors += 1
+            return web.Response(status=500, text='Injected error')
+
+        body = await request.json()
+        if isinstance(body, list):
+            if not self.supports_batch:
+                return web.json_response({'jsonrpc': '2.0', 'id': None, 'error': {
+                    'code': -32600, 'message': 'Invalid request.', 'data': 'Batch requests are not supported.'}})
+            return web.json_response([self.handle_call(call) for call in body])
+        return web.json_response(self.handle_call(body))
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        app = web.Application(client_max_size=64 * 1024 ** 2)
+        app.router.add_post('/api_jsonrpc.php', self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        bound_port = site._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{bound_port}"
+
+    async def stop(self) -> None:
+        if self.runner:
+            await self.runner.cleanup()
+
+
+async def serve(options: argparse.Namespace) -> None:
+    server = MockZabbixServer(options.hosts, options.mounts, options.latency, options.error_rate,
+                              not options.no_batch)
+    url = await server.start(options.bind, options.port)
+    logging.info(f"Mock Zabbix API listening on {url}/api_jsonrpc.php with {options.hosts} hosts")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a mock Zabbix JSON-RPC API for local testing')
+    parser.add_argument('--bind', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--hosts', type=int, default=100)
+    parser.add_argument('--mounts', type=int, default=3, help='mount points per host')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every HTTP request')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with HTTP 500')
+    parser.add_argument('--no-batch', action='store_true', help='reject JSON-RPC batch requests')
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    asyncio.run(serve(parser.parse_args()))
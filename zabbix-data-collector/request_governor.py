@@ -0,0 +1,181 @@
+import asyncio
+import collections
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Optional, Set, Tuple
+import aiohttp
+from metrics import API_CIRCUIT_OPENS, API_REQUESTS_REJECTED
+from zabbix_types import ZabbixInstance
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class RequestGovernor:
+    # Paces the API requests sent to one Zabbix frontend: a token bucket caps the request rate, an AIMD
+    # limit shrinks concurrency when the server slows down or returns 5xx, and a circuit breaker fails
+    # fast for a cooling period after repeated server failures. All state lives on the event loop thread.
+    def __init__(self, name: str, rate_limit: Optional[float] = None, burst: Optional[int] = None,
+                 max_concurrency: int = 10, min_concurrency: int = 1, latency_target: float = 5.0,
+                 failure_threshold: int = 5, cooldown: float = 60.0):
+        self.name = name
+        self.rate_limit = rate_limit
+        self.burst = burst or max(1, int(rate_limit or 1))
+        self.tokens = float(self.burst)
+        self.refilled_at = time.monotonic()
+
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min(min_concurrency, max_concurrency)
+        self.limit = float(max_concurrency)
+        self.latency_target = latency_target
+        self.in_flight = 0
+        self.waiters = collections.deque()
+        self.decreased_at = 0.0
+
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+
+    @staticmethod
+    def is_server_failure(error: BaseException) -> bool:
+        # Overload and outage signals; client-side errors (4xx, bad JSON) say nothing about server health
+        if isinstance(error, aiohttp.ClientResponseError):
+            return error.status >= 500 or error.status == 429
+        return isinstance(error, (asyncio.TimeoutError, aiohttp.ClientConnectionError))
+
+    def _check_circuit(self) -> None:
+        if self.opened_at is None:
+            return
+        remaining = self.cooldown - (time.monotonic() - self.opened_at)
+        if remaining > 0 or self.probing:
+            API_REQUESTS_REJECTED.inc(instance=self.name)
+            raise CircuitOpenError(f"Circuit for {self.name} is open, failing fast for another {max(remaining, 0):.0f}s")
+        # Half-open: a single probe decides whether the circuit closes again
+        self.probing = True
+
+    async def _take_token(self) -> None:
+        if not self.rate_limit:
+            return
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.rate_limit)
+            self.refilled_at = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate_limit)
+
+    async def _acquire_slot(self) -> None:
+        while self.in_flight >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                if waiter in self.waiters:
+                    self.waiters.remove(waiter)
+        self.in_flight += 1
+
+    def _release_slot(self) -> None:
+        self.in_flight -= 1
+        free = int(self.limit) - self.in_flight
+        while free > 0 and self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    def _decrease(self, reason: str) -> None:
+        # Multiplicative decrease, at most once per latency window so one slow burst only halves the limit once
+        now = time.monotonic()
+        if now - self.decreased_at < self.latency_target or self.limit <= self.min_concurrency:
+            return
+        self.decreased_at = now
+        self.limit = max(self.min_concurrency, self.limit / 2)
+        logging.warning(f"Reducing concurrency for {self.name} to {int(self.limit)} ({reason})")
+
+    def _record(self, latency: float, failed: bool) -> None:
+        self.probing = False
+        if failed:
+            self.failures += 1
+            self._decrease('server error')
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                API_CIRCUIT_OPENS.inc(instance=self.name)
+                logging.error(f"Opening circuit for {self.name} after {self.failures} failed requests, "
+                              f"failing fast for {self.cooldown:.0f}s")
+            return
+
+        if self.opened_at is not None:
+            logging.info(f"Closing circuit for {self.name}, the probe request succeeded")
+            self.opened_at = None
+        self.failures = 0
+        if latency > self.latency_target:
+            self._decrease(f"latency {latency:.1f}s")
+        else:
+            # Additive increase: about one more slot per limit's worth of healthy responses
+            self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+
+    @asynccontextmanager
+    async def request(self):
+        self._check_circuit()
+        try:
+            await self._take_token()
+            await self._acquire_slot()
+        except BaseException:
+            self.probing = False
+            raise
+
+        started = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            self._record(time.monotonic() - started, self.is_server_failure(e))
+            raise
+        else:
+            self._record(time.monotonic() - started, False)
+        finally:
+            # Covers cancellation, which skips both branches above
+            self.probing = False
+            self._release_slot()
+
+
+# One governor per Zabbix frontend for the life of the process, so daemon cycles share the circuit state
+GOVERNORS: Dict[str, RequestGovernor] = {}
+# Settings each governor was created with, and the plants already warned about differing from them
+GOVERNOR_SETTINGS: Dict[str, dict] = {}
+CONFLICTS_WARNED: Set[Tuple[str, str]] = set()
+
+
+def governor_settings(instance: ZabbixInstance) -> dict:
+    rate_limit = instance.get('rate_limit')
+    return {
+        'rate_limit': float(rate_limit) if rate_limit else None,
+        'burst': instance.get('rate_burst'),
+        'max_concurrency': int(instance.get('max_concurrency', 10)),
+        'min_concurrency': int(instance.get('min_concurrency', 1)),
+        'latency_target': float(instance.get('latency_target', 5.0)),
+        'failure_threshold': int(instance.get('circuit_failures', 5)),
+        'cooldown': float(instance.get('circuit_cooldown', 60)),
+    }
+
+
+def get_governor(instance: ZabbixInstance) -> RequestGovernor:
+    # Plants on the same frontend share its governor, which keeps the settings of the first plant seen
+    url = instance['url']
+    name = instance.get('plant_name', url)
+    settings = governor_settings(instance)
+    governor = GOVERNORS.get(url)
+    if governor is None:
+        governor = GOVERNORS[url] = RequestGovernor(name, **settings)
+        GOVERNOR_SETTINGS[url] = settings
+    elif settings != GOVERNOR_SETTINGS[url] and (url, name) not in CONFLICTS_WARNED:
+        CONFLICTS_WARNED.add((url, name))
+        differing = ', '.join(key for key in settings if settings[key] != GOVERNOR_SETTINGS[url][key])
+        logging.warning(f"Plant {name} shares {url} with plant {governor.name}; its request governor settings "
+                        f"({differing}) are ignored in favour of those of {governor.name}")
+    return governor
@@ -0,0 +1,40 @@
+import argparse
+import logging
+import sys
+from collector import setup_logging, load_config
+from database_manager import DatabaseManager
+
+
+def main(options: argparse.Namespace) -> int:
+    setup_logging()
+    try:
+        config = load_config(options.config)
+        db_manager = DatabaseManager(config['database'], load_caches=False)
+        missing_tables, missing_columns = db_manager.schema_changes()
+    except Exception as e:
+        logging.error(f"Error checking the database schema: {str(e)}", exc_info=True)
+        return 2
+
+    for table in missing_tables:
+        logging.info(f"Missing table {table.name}")
+    for column in missing_columns:
+        logging.info(f"Missing column {column.table.name}.{column.name}")
+    if not missing_tables and not missing_columns:
+        logging.info("Database schema is up to date")
+        return 0
+    if options.check:
+        return 1
+
+    try:
+        changes = db_manager.migrate_schema()
+    except Exception:
+        return 2
+    logging.info(f"Applied {changes} schema changes")
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Create missing tables and columns in the collector database')
+    parser.add_argument('--config', default='config.yml', help='path to the configuration file')
+    parser.add_argument('--check', action='store_true', help='only report missing tables and columns; exit 1 if any')
+    sys.exit(main(parser.parse_args()))
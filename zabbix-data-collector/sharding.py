@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import logging.handlers
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from collector import failed_instance_status, run_zbx_instance
+from host_inventory import HostInventory, create_host_inventory
+from http_session import create_http_session
+from item_state import ItemStateStore
+from metrics import REGISTRY
+from sinks import create_sink
+from token_cache import TokenCache
+from zabbix_types import InstanceRunStatus, ZabbixInstance
+
+
+def shard_instances(instances: List[ZabbixInstance], processes: int) -> List[List[Tuple[int, ZabbixInstance]]]:
+    # Round-robin keeps shard sizes within one instance of each other; indexes map results back to the config
+    indexed = list(enumerate(instances))
+    shards = [indexed[shard::processes] for shard in range(processes)]
+    return [shard for shard in shards if shard]
+
+
+def token_cache_key(instance: ZabbixInstance) -> Optional[str]:
+    # Same key ZabbixAuth uses; instances with a static token never touch the cache
+    if instance.get('token') or 'username' not in instance:
+        return None
+    return f"{instance['username']}@{instance['url']}"
+
+
+def init_worker(log_queue: multiprocessing.Queue) -> None:
+    # Workers only forward records; the parent's handlers do the formatting and file rotation
+    root = logging.getLogger()
+    root.handlers = [logging.handlers.QueueHandler(log_queue)]
+    root.setLevel(logging.DEBUG)
+
+
+def run_shard(config: dict, shard: List[Tuple[int, ZabbixInstance]], run_id: int,
+              item_clocks: Optional[Dict[str, Dict[str, int]]],
+              token_entries: Optional[Dict[str, dict]], persistent_tokens: bool,
+              inventory_snapshots: Optional[Dict[str, dict]]) -> dict:
+    return asyncio.run(_run_shard(config, shard, run_id, item_clocks, token_entries, persistent_tokens,
+                                  inventory_snapshots))
+
+
+async def _run_shard(config, shard, run_id, item_clocks, token_entries, persistent_tokens, inventory_snapshots) -> dict:
+    # Everything below belongs to this process: event loop, HTTP pool, sink and DB engine.
+    # A reused worker must not report the previous shard's metrics a second time.
+    REGISTRY.clear()
+    item_state = None
+    if item_clocks is not None:
+        item_state = ItemStateStore(None)
+        item_state.clocks = item_clocks
+    token_cache = None
+    if token_entries is not None:
+        token_cache = TokenCache()
+        token_cache.entries = token_entries
+        # The parent persists what we hand back, so keep sessions alive the way a file cache would
+        token_cache.persistent = persistent_tokens
+    host_inventory = None
+    if inventory_snapshots is not None:
+        host_inventory = create_host_inventory(config, persistent=False)
+        host_inventory.snapshots = inventory_snapshots
+
+    # Taken up front: process_zbx_instance stores the session token on the instance dict
+    cache_keys = {token_cache_key(instance) for _, instance in shard} - {None}
+
+    sink = create_sink(config)
+    try:
+        async with create_http_session(config.get('http')) as http_session:
+            tasks = [run_zbx_instance(instance, sink, http_session, run_id=run_id, item_state=item_state,
+                                      token_cache=token_cache, host_inventory=host_inventory)
+                     for _, instance in shard]
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        sink.close()
+
+    tokens = None
+    if token_cache is not None:
+        tokens = {key: token_cache.get(key) for key in cache_keys}
+
+    return {
+        'results': {index: failed_instance_status(instance) if isinstance(result, Exception) else result
+                    for (index, instance), result in zip(shard, results)},
+        'item_clocks': item_state.clocks if item_state else None,
+        'tokens': tokens,
+        'inventory': host_inventory.snapshots if host_inventory else None,
+        'metrics': REGISTRY.snapshot(),
+    }
+
+
+async def run_sharded(config: dict, run_id: int, processes: int,
+                      item_state: Optional[ItemStateStore] = None,
+                      token_cache: Optional[TokenCache] = None,
+                      host_inventory: Optional[HostInventory] = None) -> List[InstanceRunStatus]:
+    instances = config['zabbix_instances']
+    shards = shard_instances(instances, processes)
+    logging.info(f"Running {len(instances)} Zabbix instances in {len(shards)} worker processes")
+
+    log_queue = multiprocessing.Queue()
+    listener = logging.handlers.QueueListener(log_queue, *logging.getLogger().handlers, respect_handler_level=True)
+    listener.start()
+    try:
+        loop = asyncio.get_running_loop()
+        with ProcessPoolExecutor(max_workers=len(shards), initializer=init_worker, initargs=(log_queue,)) as pool:
+            futures = []
+            for shard in shards:
+                item_clocks = None
+                if item_state is not None:
+                    item_clocks = {instance['url']: item_state.get_clocks(instance['url']) for _, instance in shard}
+                token_entries = None
+                if token_cache is not None:
+                    token_entries = {}
+                    for _, instance in shard:
+                        key = token_cache_key(instance)
+                        entry = token_cache.get(key) if key else None
+                        if entry is not None:
+                            token_entries[key] = entry
+                inventory_snapshots = None
+                if host_inventory is not None:
+                    inventory_snapshots = {instance['plant_name']: host_inventory.get(instance['plant_name'])
+                                           for _, instance in shard
+                                           if host_inventory.get(instance['plant_name']) is not None}
+                futures.append(loop.run_in_executor(pool, run_shard, config, shard, run_id, item_clocks,
+                                                    token_entries, token_cache.persistent if token_cache else False,
+                                                    inventory_snapshots))
+            shard_results = await asyncio.gather(*futures, return_exceptions=True)
+    finally:
+        listener.stop()
+
+    results: List[InstanceRunStatus] = [failed_instance_status(instance) for instance in instances]
+    for shard, shard_result in zip(shards, shard_results):
+        if isinstance(shard_result, Exception):
+            # The worker died (e.g. a pickling or import error); every instance in it counts as failed
+            logging.error(f"Worker process for {len(shard)} instances failed: {str(shard_result)}")
+            continue
+
+        for index, result in shard_result['results'].items():
+            results[index] = result
+        REGISTRY.merge(shard_result['metrics'])
+        if item_state is not None and shard_result['item_clocks']:
+            for url, clocks in shard_result['item_clocks'].items():
+                item_state.update(url, clocks)
+        if token_cache is not None and shard_result['tokens']:
+            for key, entry in shard_result['tokens'].items():
+                if entry is None:
+                    token_cache.remove(key)
+                else:
+                    token_cache.set(key, entry['token'], entry['login_style'])
+        if host_inventory is not None and shard_result['inventory']:
+            for plant_name, snapshot in shard_result['inventory'].items():
+                host_inventory.set(plant_name, snapshot)
+
+    if item_state is not None:
+        await loop.run_in_executor(None, item_state.save)
+    if host_inventory is not None:
+        await loop.run_in_executor(None, host_inventory.save)
+    return results
@@ -0,0 +1,435 @@
+import asyncio
+import csv
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+from metrics import SPOOL_BATCHES
+from wal_spool import WriteAheadSpool
+from zabbix_types import HostData, InstanceRunStatus, ServerInfo
+
+if TYPE_CHECKING:
+    # SQLAlchemy is imported only when a database sink is configured; file-only runs start without it
+    from database_manager import DatabaseManager
+    from db_writer import DatabaseWriter
+
+AVAILABILITY_TABLE = 'fact_infra_availability'
+DISK_SPACE_TABLE = 'fact_disk_space'
+HOST_METRIC_TABLE = 'fact_host_metric'
+# Spooled etl_run records of runs started while the database was down
+RUN_TABLE = 'etl_run'
+AVAILABILITY_LABELS = {True: 'Available', False: 'Unavailable', None: 'Unknown'}
+
+
+def fact_rows(plant_name: str, servers: List[ServerInfo], host_data: Dict[str, HostData],
+              run_id: int) -> Tuple[List[dict], List[dict], List[dict]]:
+    # Flat rows keyed by plant/server names so they can be loaded without the dim tables
+    now = datetime.now()
+    availability_rows = []
+    disk_space_rows = []
+    host_metric_rows = []
+    for server in servers:
+        data = host_data.get(server['hostid'])
+        if data is None:
+            continue
+        identity = {'run_id': run_id, 'plant_name': plant_name, 'server_name': server['name'],
+                    'zabbix_hostid': server['hostid']}
+        availability_rows.append({**identity, 'timestamp': data['timestamp'] or now,
+                                  'is_available': data['is_available']})
+        for disk_data in data['disk_space']:
+            disk_space_rows.append({**identity, **disk_data, 'timestamp': disk_data['timestamp'] or now})
+        for metric_data in data['metrics']:
+            host_metric_rows.append({**identity, **metric_data, 'timestamp': metric_data['timestamp'] or now})
+    return availability_rows, disk_space_rows, host_metric_rows
+
+
+class FactSink:
+    # Sinks whose run ids come from the database; MultiSink asks these first
+    authoritative_run_ids = False
+
+    async def check_plant(self, plant_name: str) -> bool:
+        return True
+
+    async def allocate_run_id(self, instance_count: Optional[int] = None) -> int:
+        raise NotImplementedError
+
+    async def finish_run(self, run_id: int, instance_statuses: List[InstanceRunStatus]) -> None:
+        pass
+
+    async def write_plant(self, plant_name: str, servers: List[ServerInfo], host_data: Dict[str, HostData],
+                          run_id: Optional[int]) -> None:
+        raise NotImplementedError
+
+    async def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class DatabaseSink(FactSink):
+    authoritative_run_ids = True
+
+    def __init__(self, db_writer: 'DatabaseWriter'):
+        self.db_writer = db_writer
+
+    async def check_plant(self, plant_name: str) -> bool:
+        return await self.db_writer.get_plant_id(plant_name) is not None
+
+    async def allocate_run_id(self, instance_count=None) -> int:
+        return await self.db_writer.allocate_run_id(instance_count)
+
+    async def finish_run(self, run_id, instance_statuses):
+        await self.db_writer.finish_run(run_id, instance_statuses)
+
+    async def write_plant(self, plant_name, servers, host_data, run_id):
+        plant_id = await self.db_writer.get_plant_id(plant_name)
+        if plant_id is None:
+            raise ValueError(f"Plant {plant_name} not found in the database.")
+
+        server_ids = await self.db_writer.resolve_servers(plant_id, servers)
+        for server in servers:
+            try:
+                server_name = server['name']
+                data = host_data.get(server['hostid'])
+                if data is None:
+                    data = HostData(is_available=None, timestamp=None, disk_space=[], metrics=[])
+                await self.db_writer.queue_host_data(server_ids[server['hostid']], data, run_id)
+                logging.info(f"Queued availability data for server {server_name}: {AVAILABILITY_LABELS[data['is_available']]}")
+                for disk_data in data['disk_space']:
+                    logging.debug(f"Queued disk space data for server {server_name}, mount point {disk_data['mount_point']}")
+            except Exception as e:
+                logging.error(f"Error processing server {server_name} in plant {plant_name}: {str(e)}")
+
+    async def flush(self):
+        await self.db_writer.flush()
+
+    def close(self):
+        self.db_writer.close()
+
+
+class LocalRunIds:
+    # Run ids for sinks without a database: seconds since the epoch, strictly increasing within the process
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.last = 0
+
+    def allocate(self) -> int:
+        with self.lock:
+            self.last = max(self.last + 1, int(time.time()))
+            return self.last
+
+
+class BufferedFileSink(FactSink):
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.run_ids = LocalRunIds()
+        self.lock = threading.Lock()
+        self.availability_rows: List[dict] = []
+        self.disk_space_rows: List[dict] = []
+        self.host_metric_rows: List[dict] = []
+        os.makedirs(directory, exist_ok=True)
+
+    async def allocate_run_id(self, instance_count=None) -> int:
+        return self.run_ids.allocate()
+
+    async def write_plant(self, plant_name, servers, host_data, run_id):
+        availability_rows, disk_space_rows, host_metric_rows = fact_rows(plant_name, servers, host_data, run_id)
+        with self.lock:
+            self.availability_rows.extend(availability_rows)
+            self.disk_space_rows.extend(disk_space_rows)
+            self.host_metric_rows.extend(host_metric_rows)
+
+    async def flush(self):
+        with self.lock:
+            availability_rows, self.availability_rows = self.availability_rows, []
+            disk_space_rows, self.disk_space_rows = self.disk_space_rows, []
+            host_metric_rows, self.host_metric_rows = self.host_metric_rows, []
+        if availability_rows or disk_space_rows or host_metric_rows:
+            # File I/O and encoding happen off the event loop
+            await asyncio.get_running_loop().run_in_executor(
+                None, self.write_files, availability_rows, disk_space_rows, host_metric_rows)
+
+    def write_files(self, availability_rows: List[dict], disk_space_rows: List[dict],
+                    host_metric_rows: List[dict]) -> None:
+        raise NotImplementedError
+
+
+class PartitionedFileSink(BufferedFileSink):
+    # Writes <directory>/<table>/plant=<name>/date=<YYYY-MM-DD>/part-*.parquet (or .csv)
+    def __init__(self, directory: str, file_format: str = 'parquet'):
+        super().__init__(directory)
+        if file_format not in ('parquet', 'csv'):
+            raise ValueError(f"Unsupported file sink format: {file_format}")
+        if file_format == 'parquet':
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                raise ValueError("The parquet sink requires pyarrow (pip install pyarrow)")
+        self.file_format = file_format
+
+    def write_files(self, availability_rows, disk_space_rows, host_metric_rows):
+        for table, rows in ((AVAILABILITY_TABLE, availability_rows), (DISK_SPACE_TABLE, disk_space_rows),
+                            (HOST_METRIC_TABLE, host_metric_rows)):
+            partitions = defaultdict(list)
+            for row in rows:
+                partitions[(row['plant_name'], row['timestamp'].strftime('%Y-%m-%d'))].append(row)
+
+            for (plant_name, date), partition_rows in partitions.items():
+                partition_dir = os.path.join(self.directory, table, f"plant={plant_name}", f"date={date}")
+                os.makedirs(partition_dir, exist_ok=True)
+                path = os.path.join(partition_dir, f"part-{partition_rows[0]['run_id']}-{uuid.uuid4().hex[:8]}.{self.file_format}")
+                if self.file_format == 'parquet':
+                    self._write_parquet(path, partition_rows)
+                else:
+                    self._write_csv(path, partition_rows)
+            if rows:
+                logging.info(f"Wrote {len(rows)} {table} rows to {self.directory} in {len(partitions)} {self.file_format} files")
+
+    @staticmethod
+    def _write_parquet(path: str, rows: List[dict]) -> None:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_pylist(rows)
+        pq.write_table(table, f"{path}.tmp")
+        os.replace(f"{path}.tmp", path)
+
+    @staticmethod
+    def _write_csv(path: str, rows: List[dict]) -> None:
+        with open(f"{path}.tmp", 'w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
+        os.replace(f"{path}.tmp", path)
+
+
+class SpoolSink(BufferedFileSink):
+    # One JSON-lines file per flush; spool_loader.py imports them into SQL Server
+    def write_files(self, availability_rows, disk_space_rows, host_metric_rows):
+        name = f"{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}.jsonl"
+        tmp_path = os.path.join(self.directory, f".{name}.tmp")
+        with open(tmp_path, 'w') as file:
+            for table, rows in ((AVAILABILITY_TABLE, availability_rows), (DISK_SPACE_TABLE, disk_space_rows),
+                                (HOST_METRIC_TABLE, host_metric_rows)):
+                for row in rows:
+                    file.write(json.dumps({**row, 'table': table, 'timestamp': row['timestamp'].isoformat()}))
+                    file.write('\n')
+        # The loader only picks up *.jsonl, so the rename publishes the file atomically
+        os.replace(tmp_path, os.path.join(self.directory, name))
+        logging.info(f"Spooled {len(availability_rows) + len(disk_space_rows) + len(host_metric_rows)} rows to {name}")
+
+
+class DurableSink(FactSink):
+    # Rows go to a local write-ahead spool first and are drained to the database in idempotent
+    # batches, so a database outage delays the facts instead of dropping them
+    authoritative_run_ids = True
+
+    def __init__(self, spool: WriteAheadSpool, db_config: dict, batch_rows: int = 5000,
+                 drain_interval: float = 30):
+        self.spool = spool
+        self.db_config = db_config
+        self.batch_rows = batch_rows
+        self.drain_interval = drain_interval
+        self.db_manager: Optional['DatabaseManager'] = None
+        self.run_ids = LocalRunIds()
+        # Local run id -> start time. Local ids are negative so they never meet etl_run's identity values.
+        self.local_run_ids: Dict[int, datetime] = {}
+        self.drain_lock = asyncio.Lock()
+        self.drainer: Optional[asyncio.Task] = None
+        # One thread for both the spool and the database keeps SQLite and the DB session single-threaded
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='durable-sink')
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def _get_db_manager(self) -> 'DatabaseManager':
+        # Created on first use so the collector can start while the database is down
+        if self.db_manager is None:
+            from database_manager import DatabaseManager
+            self.db_manager = DatabaseManager(self.db_config)
+        return self.db_manager
+
+    async def check_plant(self, plant_name):
+        try:
+            db_manager = await self._run(self._get_db_manager)
+            return await self._run(db_manager.get_plant_id, plant_name) is not None
+        except Exception as e:
+            logging.warning(f"Database unavailable, spooling data for plant {plant_name} unchecked: {str(e)}")
+            return True
+
+    async def allocate_run_id(self, instance_count=None):
+        try:
+            db_manager = await self._run(self._get_db_manager)
+            return await self._run(db_manager.allocate_run_id, instance_count)
+        except Exception as e:
+            run_id = -self.run_ids.allocate()
+            started_at = self.local_run_ids[run_id] = datetime.now()
+            # The etl_run row is written when the spool drains, together with the facts
+            await self._run(self.spool.append, RUN_TABLE, [
+                {'run_id': run_id, 'timestamp': started_at, 'instance_count': instance_count}])
+            logging.warning(f"Database unavailable, using local run id {run_id}: {str(e)}")
+            return run_id
+
+    async def finish_run(self, run_id, instance_statuses):
+        if run_id in self.local_run_ids:
+            started_at = self.local_run_ids.pop(run_id)
+            await self._run(self.spool.append, RUN_TABLE, [{
+                'run_id': run_id, 'timestamp': started_at, 'finished_at': datetime.now().isoformat(),
+                'instances': [{**status, 'started_at': status['started_at'].isoformat(),
+                               'finished_at': status['finished_at'].isoformat()} for status in instance_statuses]
+            }])
+            return
+        try:
+            db_manager = await self._run(self._get_db_manager)
+            await self._run(db_manager.finish_run, run_id, instance_statuses)
+        except Exception as e:
+            logging.warning(f"Could not record run {run_id} in the database: {str(e)}")
+
+    async def write_plant(self, plant_name, servers, host_data, run_id):
+        availability_rows, disk_space_rows, host_metric_rows = fact_rows(plant_name, servers, host_data, run_id)
+        await self._run(self.spool.append, AVAILABILITY_TABLE, availability_rows)
+        await self._run(self.spool.append, DISK_SPACE_TABLE, disk_space_rows)
+        await self._run(self.spool.append, HOST_METRIC_TABLE, host_metric_rows)
+        logging.info(f"Spooled {len(availability_rows) + len(disk_space_rows) + len(host_metric_rows)} rows for plant {plant_name}")
+
+    async def flush(self):
+        if self.drainer is None:
+            self.drainer = asyncio.create_task(self._drain_periodically())
+        await self.drain_pending()
+
+    async def _drain_periodically(self):
+        while True:
+            await asyncio.sleep(self.drain_interval)
+            await self.drain_pending()
+
+    @staticmethod
+    def is_connectivity_error(error: Exception) -> bool:
+        # Errors worth retrying later; anything else means the batch itself is bad and would block the spool
+        from sqlalchemy.exc import DBAPIError, OperationalError
+        if isinstance(error, (OSError, OperationalError)):
+            return True
+        return isinstance(error, DBAPIError) and error.connection_invalidated
+
+    async def drain_pending(self) -> int:
+        # Loads batches until the spool is empty or the database fails; never raises
+        loaded = 0
+        async with self.drain_lock:
+            while True:
+                batch_key = await self._run(self.spool.next_batch, self.batch_rows)
+                if batch_key is None:
+                    break
+                try:
+                    # Failing to connect (or to load the dimension caches) says nothing about the batch
+                    await self._run(self._get_db_manager)
+                except Exception as e:
+                    SPOOL_BATCHES.inc(status='retry')
+                    pending = await self._run(self.spool.pending_count)
+                    logging.warning(f"Database unavailable, {pending} rows stay in the spool: {str(e)}")
+                    break
+                try:
+                    loaded += await self._run(self._load_batch, batch_key)
+                except Exception as e:
+                    if self.is_connectivity_error(e):
+                        SPOOL_BATCHES.inc(status='retry')
+                        pending = await self._run(self.spool.pending_count)
+                        logging.warning(f"Database unavailable, {pending} rows stay in the spool: {str(e)}")
+                        break
+                    await self._run(self.spool.mark_dead, batch_key)
+                    SPOOL_BATCHES.inc(status='dead')
+                    logging.error(f"Database rejected spool batch {batch_key}, keeping it as dead: "
+                                  f"{type(e).__name__}: {str(e)}")
+        return loaded
+
+    def _load_batch(self, batch_key: str) -> int:
+        availability_rows = []
+        disk_space_rows = []
+        host_metric_rows = []
+        run_rows = []
+        for table_name, row in self.spool.batch_rows(batch_key):
+            if table_name == AVAILABILITY_TABLE:
+                availability_rows.append(row)
+            elif table_name == HOST_METRIC_TABLE:
+                host_metric_rows.append(row)
+            elif table_name == RUN_TABLE:
+                run_rows.append(row)
+            else:
+                disk_space_rows.append(row)
+        try:
+            loaded = self._get_db_manager().write_fact_batch(batch_key, availability_rows, disk_space_rows,
+                                                             host_metric_rows, run_rows)
+        except Exception as e:
+            # Drop pooled connections so the next attempt reconnects from scratch
+            if self.is_connectivity_error(e) and self.db_manager is not None:
+                self.db_manager.engine.dispose()
+            raise
+        self.spool.complete_batch(batch_key)
+        SPOOL_BATCHES.inc(status='loaded' if loaded else 'duplicate')
+        return len(availability_rows) + len(disk_space_rows) + len(host_metric_rows) if loaded else 0
+
+    def close(self):
+        if self.drainer is not None:
+            self.drainer.cancel()
+        self.executor.shutdown(wait=True)
+        self.spool.close()
+
+
+class MultiSink(FactSink):
+    def __init__(self, sinks: List[FactSink]):
+        self.sinks = sinks
+
+    async def check_plant(self, plant_name):
+        results = await asyncio.gather(*(sink.check_plant(plant_name) for sink in self.sinks))
+        return all(results)
+
+    async def allocate_run_id(self, instance_count=None):
+        return await self._run_id_sink().allocate_run_id(instance_count)
+
+    async def finish_run(self, run_id, instance_statuses):
+        await self._run_id_sink().finish_run(run_id, instance_statuses)
+
+    def _run_id_sink(self) -> FactSink:
+        # Database run ids win so every sink labels a run the same way
+        for sink in self.sinks:
+            if sink.authoritative_run_ids:
+                return sink
+        return self.sinks[0]
+
+    async def write_plant(self, plant_name, servers, host_data, run_id):
+        await asyncio.gather(*(sink.write_plant(plant_name, servers, host_data, run_id) for sink in self.sinks))
+
+    async def flush(self):
+        await asyncio.gather(*(sink.flush() for sink in self.sinks))
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+
+def create_sink(config: dict) -> FactSink:
+    sink_configs = config.get('sinks') or [{'type': 'database'}]
+    sinks = []
+    for sink_config in sink_configs:
+        sink_type = sink_config.get('type')
+        if sink_type == 'database' and sink_config.get('write_ahead_spool'):
+            sinks.append(DurableSink(WriteAheadSpool(sink_config['write_ahead_spool']), config['database'],
+                                     batch_rows=sink_config.get('batch_rows', 5000),
+                                     drain_interval=sink_config.get('drain_interval', 30)))
+        elif sink_type == 'database':
+            from database_manager import DatabaseManager
+            from db_writer import DatabaseWriter
+            sinks.append(DatabaseSink(DatabaseWriter(DatabaseManager(config['database']))))
+        elif sink_type in ('parquet', 'csv'):
+            sinks.append(PartitionedFileSink(sink_config.get('directory', 'output'), sink_type))
+        elif sink_type == 'spool':
+            sinks.append(SpoolSink(sink_config.get('directory', 'spool')))
+        else:
+            raise ValueError(f"Unknown sink type: {sink_type}")
+        logging.info(f"Configured {sink_type} sink")
+    return sinks[0] if len(sinks) == 1 else MultiSink(sinks)
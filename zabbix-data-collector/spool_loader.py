@@ -0,0 +1,66 @@
+import argparse
+import glob
+import json
+import logging
+import os
+from datetime import datetime
+from collector import setup_logging, load_config
+from database_manager import DatabaseManager
+from sinks import AVAILABILITY_TABLE, HOST_METRIC_TABLE
+
+
+def load_spool_file(db_manager: DatabaseManager, path: str) -> int:
+    availability_rows = []
+    disk_space_rows = []
+    host_metric_rows = []
+    with open(path, 'r') as file:
+        for line in file:
+            if line.strip():
+                row = json.loads(line)
+                row['timestamp'] = datetime.fromisoformat(row['timestamp'])
+                if row['table'] == AVAILABILITY_TABLE:
+                    availability_rows.append(row)
+                elif row['table'] == HOST_METRIC_TABLE:
+                    host_metric_rows.append(row)
+                else:
+                    disk_space_rows.append(row)
+
+    # The file name is the batch key, so a file that was loaded but not moved is not loaded twice
+    db_manager.write_fact_batch(f"file:{os.path.basename(path)}", availability_rows, disk_space_rows, host_metric_rows)
+    return len(availability_rows) + len(disk_space_rows) + len(host_metric_rows)
+
+
+def main(options: argparse.Namespace):
+    setup_logging()
+    try:
+        config = load_config(options.config)
+        db_manager = DatabaseManager(config['database'])
+    except Exception as e:
+        logging.error(f"Error initializing spool loader: {str(e)}", exc_info=True)
+        return
+
+    loaded_dir = os.path.join(options.spool_dir, 'loaded')
+    paths = sorted(glob.glob(os.path.join(options.spool_dir, '*.jsonl')))
+    logging.info(f"Found {len(paths)} spool files in {options.spool_dir}")
+
+    for path in paths:
+        try:
+            rows = load_spool_file(db_manager, path)
+        except Exception as e:
+            logging.error(f"Error loading spool file {path}, leaving it for the next run: {str(e)}")
+            continue
+
+        if options.delete:
+            os.remove(path)
+        else:
+            os.makedirs(loaded_dir, exist_ok=True)
+            os.replace(path, os.path.join(loaded_dir, os.path.basename(path)))
+        logging.info(f"Loaded {rows} rows from {os.path.basename(path)}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Bulk-load spooled fact files into the database')
+    parser.add_argument('--config', default='config.yml', help='path to the configuration file')
+    parser.add_argument('--spool-dir', default='spool', help='directory the spool sink writes to')
+    parser.add_argument('--delete', action='store_true', help='delete files after loading instead of moving them to loaded/')
+    main(parser.parse_args())
@@ -0,0 +1,65 @@
+import json
+import logging
+import os
+import threading
+from typing import Dict, Optional
+
+
+class TokenCache:
+    # Memory-only tokens are lost with the process, so their sessions are still logged out after use
+    persistent = False
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # "username@url" -> {'token': ..., 'login_style': ...}
+        self.entries: Dict[str, dict] = {}
+
+    def get(self, key: str) -> Optional[dict]:
+        with self.lock:
+            return self.entries.get(key)
+
+    def set(self, key: str, token: str, login_style: Optional[str]) -> None:
+        with self.lock:
+            self.entries[key] = {'token': token, 'login_style': login_style}
+            self._persist()
+
+    def remove(self, key: str) -> None:
+        with self.lock:
+            if self.entries.pop(key, None) is not None:
+                self._persist()
+
+    def _persist(self) -> None:
+        pass
+
+
+class FileTokenCache(TokenCache):
+    persistent = True
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as file:
+                    self.entries = json.load(file)
+                logging.info(f"Loaded {len(self.entries)} cached Zabbix tokens from {path}")
+            except Exception as e:
+                logging.error(f"Error loading token cache from {path}, starting empty: {str(e)}")
+
+    def _persist(self) -> None:
+        # Tokens are credentials: create the file readable by the owner only and replace it atomically
+        tmp_path = f"{self.path}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as file:
+            json.dump(self.entries, file)
+        os.chmod(tmp_path, 0o600)
+        os.replace(tmp_path, self.path)
+
+
+def create_token_cache(config: dict) -> Optional[TokenCache]:
+    cache_config = config.get('token_cache') or {}
+    if not cache_config.get('enabled', False):
+        return None
+    if cache_config.get('file'):
+        return FileTokenCache(cache_config['file'])
+    return TokenCache()
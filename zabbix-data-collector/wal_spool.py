@@ -0,0 +1,90 @@
+import json
+import logging
+import sqlite3
+import threading
+import uuid
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+
+class WriteAheadSpool:
+    # Collected rows are committed to a local SQLite file before the database sees them. A batch
+    # keeps its key until the database confirms it, so a replay after a crash is deduplicated by
+    # DatabaseManager.write_fact_batch.
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=FULL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS spool_meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS spool_rows ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, table_name TEXT NOT NULL, payload TEXT NOT NULL, "
+            "batch_key TEXT, dead INTEGER NOT NULL DEFAULT 0)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS ix_spool_rows_batch ON spool_rows (batch_key)")
+        row = self.conn.execute("SELECT value FROM spool_meta WHERE key = 'spool_id'").fetchone()
+        if row is None:
+            # Batch keys are only unique per spool file, so each file gets its own id
+            self.spool_id = uuid.uuid4().hex[:12]
+            self.conn.execute("INSERT INTO spool_meta (key, value) VALUES ('spool_id', ?)", (self.spool_id,))
+        else:
+            self.spool_id = row[0]
+        self.conn.commit()
+        logging.info(f"Opened write-ahead spool {path} with {self.pending_count()} pending rows")
+
+    def append(self, table_name: str, rows: List[dict]) -> None:
+        if not rows:
+            return
+        payloads = [(table_name, json.dumps({**row, 'timestamp': row['timestamp'].isoformat()})) for row in rows]
+        with self.lock:
+            self.conn.executemany("INSERT INTO spool_rows (table_name, payload) VALUES (?, ?)", payloads)
+            self.conn.commit()
+
+    def next_batch(self, limit: int) -> Optional[str]:
+        with self.lock:
+            # A batch that was handed out but never confirmed goes first, under the same key
+            row = self.conn.execute(
+                "SELECT batch_key FROM spool_rows WHERE batch_key IS NOT NULL AND dead = 0 ORDER BY id LIMIT 1").fetchone()
+            if row is not None:
+                return row[0]
+
+            ids = [r[0] for r in self.conn.execute(
+                "SELECT id FROM spool_rows WHERE batch_key IS NULL ORDER BY id LIMIT ?", (limit,))]
+            if not ids:
+                return None
+            batch_key = f"{self.spool_id}:{ids[0]}-{ids[-1]}"
+            self.conn.execute("UPDATE spool_rows SET batch_key = ? WHERE batch_key IS NULL AND id BETWEEN ? AND ?",
+                              (batch_key, ids[0], ids[-1]))
+            self.conn.commit()
+            return batch_key
+
+    def batch_rows(self, batch_key: str) -> List[Tuple[str, dict]]:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT table_name, payload FROM spool_rows WHERE batch_key = ? ORDER BY id", (batch_key,)).fetchall()
+        result = []
+        for table_name, payload in rows:
+            row = json.loads(payload)
+            row['timestamp'] = datetime.fromisoformat(row['timestamp'])
+            result.append((table_name, row))
+        return result
+
+    def complete_batch(self, batch_key: str) -> None:
+        with self.lock:
+            self.conn.execute("DELETE FROM spool_rows WHERE batch_key = ?", (batch_key,))
+            self.conn.commit()
+
+    def mark_dead(self, batch_key: str) -> None:
+        # Batches the database rejects outright stay in the file for inspection instead of blocking the queue
+        with self.lock:
+            self.conn.execute("UPDATE spool_rows SET dead = 1 WHERE batch_key = ?", (batch_key,))
+            self.conn.commit()
+
+    def pending_count(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM spool_rows WHERE dead = 0").fetchone()[0]
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
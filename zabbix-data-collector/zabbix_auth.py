@@ -1,14 +1,30 @@
+import asyncio
 import aiohttp
 import logging
 from types import TracebackType
 from typing import Optional, Type
+from token_cache import TokenCache
 from zabbix_types import ZabbixInstance
 
+# user.login parameter name for the username: Zabbix 5.4+ uses 'username', older versions 'user'
+LOGIN_STYLES = ['username', 'user']
+
+# Error texts Zabbix returns when a session token is expired or was logged out
+AUTH_ERROR_MARKERS = ('re-login', 'not authorised', 'not authorized', 'session terminated', 'token expired')
+
 class ZabbixAuth:
-    def __init__(self, url: str):
+    def __init__(self, url: str, session: Optional[aiohttp.ClientSession] = None,
+                 token_cache: Optional[TokenCache] = None):
         self.url = url
         self.auth_token: Optional[str] = None
-        self.session: Optional[aiohttp.ClientSession] = None
+        self.session: Optional[aiohttp.ClientSession] = session
+        # Only close sessions this object created itself; shared sessions are closed by their owner
+        self.owns_session = session is None
+        self.token_cache = token_cache
+        self.login_style: Optional[str] = None
+        self.username: Optional[str] = None
+        self.password: Optional[str] = None
+        self.relogin_lock = asyncio.Lock()
 
     async def __aenter__(self):
         await self.ensure_session()
@@ -25,30 +41,43 @@ class ZabbixAuth:
     async def ensure_session(self) -> None:
         if self.session is None or self.session.closed:
             self.session = aiohttp.ClientSession()
+            self.owns_session = True
 
     async def close(self) -> None:
-        if self.session and not self.session.closed:
+        if self.owns_session and self.session and not self.session.closed:
             await self.session.close()
 
+    @property
+    def cache_key(self) -> str:
+        return f"{self.username}@{self.url}"
+
+    @property
+    def can_relogin(self) -> bool:
+        return self.username is not None and self.password is not None
+
+    @staticmethod
+    def is_auth_error(result) -> bool:
+        if not isinstance(result, dict) or 'error' not in result:
+            return False
+        error = result['error']
+        text = f"{error.get('message', '')} {error.get('data', '')}".lower()
+        return any(marker in text for marker in AUTH_ERROR_MARKERS)
+
     async def login(self, username: str, password: str):
         await self.ensure_session()
+        self.username = username
+        self.password = password
 
-        attempts = [
-            {'username': username},
-            username  # Fallback: send username directly without a key
-        ]
+        # Try the style that worked last time first
+        styles = sorted(LOGIN_STYLES, key=lambda style: style != self.login_style)
 
-        for attempt in attempts:
+        for style in styles:
             login_data = {
                 "jsonrpc": "2.0",
                 "method": "user.login",
-                "params": {"password": password},
+                "params": {"password": password, style: username},
                 "id": 1
             }
-            if isinstance(attempt, dict):
-                login_data["params"].update(attempt)
-            else:
-                login_data["params"][attempt] = username
 
             try:
                 async with self.session.post(f"{self.url}/api_jsonrpc.php", json=login_data) as response:
@@ -56,17 +85,47 @@ class ZabbixAuth:
                     result = await response.json()
                     if 'result' in result:
                         self.auth_token = result['result']
-                        logging.info(f"Successfully logged in using {attempt}")
+                        self.login_style = style
+                        if self.token_cache is not None:
+                            self.token_cache.set(self.cache_key, self.auth_token, style)
+                        logging.info(f"Successfully logged in using '{style}'")
                         return
                     else:
                         error_message = result.get('error', {}).get('data', 'Unknown error')
-                        logging.warning(f"Login attempt with {attempt} failed: {error_message}")
+                        logging.warning(f"Login attempt with '{style}' failed: {error_message}")
             except Exception as e:
-                logging.error(f"Error during login attempt with {attempt}: {str(e)}")
+                logging.error(f"Error during login attempt with '{style}': {str(e)}")
 
         # If we've reached this point, all attempts have failed
         raise Exception("Login failed with all attempted methods")
 
+    async def ensure_login(self, username: str, password: str):
+        # Reuse a cached token without validating it; api_request re-logs in if it turns out to be stale
+        self.username = username
+        self.password = password
+        cached = self.token_cache.get(self.cache_key) if self.token_cache is not None else None
+        if cached:
+            self.auth_token = cached['token']
+            self.login_style = cached.get('login_style')
+            logging.info(f"Reusing cached Zabbix token for {self.cache_key}")
+            return
+        await self.login(username, password)
+
+    async def relogin(self, stale_token: Optional[str]):
+        async with self.relogin_lock:
+            # Concurrent requests that failed with the same token only need one new login
+            if self.auth_token != stale_token:
+                return
+            if self.token_cache is not None:
+                self.token_cache.remove(self.cache_key)
+            await self.login(self.username, self.password)
+
+    async def release(self):
+        # End of a run: keep the session alive only if a persistent cache can hand it to the next run
+        if self.token_cache is None or not self.token_cache.persistent or not self.can_relogin:
+            await self.logout()
+        await self.close()
+
     async def logout(self):
         if self.auth_token:
             await self.ensure_session()
@@ -80,12 +139,15 @@ class ZabbixAuth:
             try:
                 async with self.session.post(f"{self.url}/api_jsonrpc.php", json=logout_data) as response:
                     response.raise_for_status()
+                if self.token_cache is not None and self.can_relogin:
+                    self.token_cache.remove(self.cache_key)
                 self.auth_token = None
                 logging.info("Successfully logged out")
             except Exception as e:
                 logging.error(f"Error during logout: {str(e)}")
 
-async def get_zabbix_token(url: str, username: str, password: str) -> ZabbixAuth:
-    auth = ZabbixAuth(url)
+async def get_zabbix_token(url: str, username: str, password: str,
+                           session: Optional[aiohttp.ClientSession] = None) -> ZabbixAuth:
+    auth = ZabbixAuth(url, session)
     await auth.login(username, password)
     return auth
@@ -1,121 +1,519 @@
 import asyncio
 import aiohttp
-from typing import List, Optional
-from zabbix_types import ZabbixInstance, ServerInfo, DiskSpaceData
+import itertools
+import time
+from datetime import datetime
+from typing import AsyncIterator, Callable, Dict, List, Optional, Set, Tuple
+from http_session import json_loads
+from item_keys import disk_item_field, host_metric, host_metric_search_patterns
+from json_stream import JsonRpcError, iter_result
+from metrics import API_REQUEST_SECONDS, API_REQUEST_ERRORS, API_REQUEST_RETRIES
+from request_governor import CircuitOpenError, RequestGovernor, get_governor
+from zabbix_auth import ZabbixAuth
+from zabbix_types import ZabbixInstance, ServerInfo, DiskSpaceData, HostData, HostMetricData
 import logging
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
+from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception
+
+# Key patterns fetched for every host in a single item.get when collecting in bulk. Searched with
+# wildcards enabled, so 'agent.ping' matches only that exact key and 'vfs.fs.size[*' is a prefix match.
+HOST_ITEM_KEYS = ['agent.ping', 'vfs.fs.size[*'] + host_metric_search_patterns()
+
+# Only the fields the collector reads are requested; 'extend' returns every column of every item
+OUTPUT_FIELDS = {
+    'hostgroup.get': ['groupid', 'name'],
+    'host.get': ['hostid', 'name'],
+    'item.get': ['itemid', 'hostid', 'key_', 'lastvalue', 'lastclock', 'value_type'],
+    'history.get': ['itemid', 'clock', 'value'],
+    'trend.get': ['itemid', 'clock', 'value_avg'],
+}
+
+
+class BatchNotSupportedError(Exception):
+    pass
+
+
+def is_retryable(error: BaseException) -> bool:
+    # Lost connections, timeouts, 5xx and 429 may pass; a 4xx answer will not change on a retry
+    return RequestGovernor.is_server_failure(error) or isinstance(error, aiohttp.ClientPayloadError)
+
+
+def count_retry(retry_state) -> None:
+    collector = retry_state.args[0]
+    API_REQUEST_RETRIES.inc(instance=collector.metrics_label)
+
 
 class ZabbixCollector:
-    def __init__(self, instance: ZabbixInstance):
+    def __init__(self, instance: ZabbixInstance, session: Optional[aiohttp.ClientSession] = None,
+                 last_clocks: Optional[Dict[str, int]] = None, auth: Optional[ZabbixAuth] = None):
         self.instance = instance
         self.api_url = f"{instance['url']}/api_jsonrpc.php"
-        self.auth_token = instance['token']
-        self.servers_group_id = None
-        self.session = None
+        # With an auth object, expired sessions are re-established on the first auth error
+        self.auth = auth
+        self.auth_token = auth.auth_token if auth else instance['token']
+        self.metrics_label = instance.get('plant_name', instance['url'])
+        # Hosts are collected from these Zabbix host groups
+        host_groups = instance.get('host_groups') or ['Servers']
+        self.host_groups: List[str] = [host_groups] if isinstance(host_groups, str) else list(host_groups)
+        self.groups: Optional[Dict[str, str]] = None
+        self.host_chunk_size = int(instance.get('host_chunk_size', 500))
+        # JSON-RPC batching; switched off for the session if the server rejects a batch
+        self.batch_supported = instance.get('jsonrpc_batch', True)
+        self.batch_size = int(instance.get('jsonrpc_batch_size', 5))
+        # Parse bulk item.get responses incrementally instead of loading them whole
+        self.stream_responses = instance.get('stream_responses', False)
+        self.request_ids = itertools.count(1)
+        # Rate, concurrency and circuit breaker for this Zabbix frontend, shared with later runs
+        self.governor = get_governor(instance)
+        self.session = session
+        self.owns_session = session is None
+        # Incremental mode: lastclock per itemid already stored, and the clocks emitted by this run
+        self.last_clocks = last_clocks
+        self.seen_clocks: Dict[str, int] = {}
+        # Hosts whose item.get failed during this run; their availability is stored as unknown
+        self.failed_hostids: Set[str] = set()
 
     async def __aenter__(self):
-        self.session = aiohttp.ClientSession()
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession()
+            self.owns_session = True
         return self
 
     async def __aexit__(self, exc_type, exc, tb):
-        await self.session.close()
+        if self.owns_session:
+            await self.session.close()
 
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10),
-           retry=retry_if_exception_type(aiohttp.ClientError))
-
-    async def api_request(self, method: str, params: dict) -> dict:
-        headers = {'Content-Type': 'application/json-rpc'}
-        data = {
+    def _build_request(self, method: str, params: dict) -> dict:
+        return {
             'jsonrpc': '2.0',
             'method': method,
-            'params': {**params, 'output': 'extend'},
+            'params': {'output': OUTPUT_FIELDS.get(method, 'extend'), **params},
             'auth': self.auth_token,
-            'id': 1
+            'id': next(self.request_ids)
         }
-        async with self.session.post(self.api_url, json=data, headers=headers) as response:
-            response.raise_for_status()
-            return await response.json()
 
-    async def get_servers_group_id(self) -> Optional[str]:
-        if self.servers_group_id is not None:
-            return self.servers_group_id
+    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10),
+           retry=retry_if_exception(is_retryable), before_sleep=count_retry, reraise=True)
+
+    async def _post(self, data):
+        headers = {'Content-Type': 'application/json-rpc'}
+        method = data['method'] if isinstance(data, dict) else 'batch'
+        try:
+            async with self.governor.request():
+                with API_REQUEST_SECONDS.time(instance=self.metrics_label, method=method):
+                    async with self.session.post(self.api_url, json=data, headers=headers) as response:
+                        response.raise_for_status()
+                        return json_loads(await response.read())
+        except CircuitOpenError:
+            raise
+        except Exception:
+            API_REQUEST_ERRORS.inc(instance=self.metrics_label, method=method)
+            raise
+
+    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10),
+           retry=retry_if_exception(is_retryable), before_sleep=count_retry, reraise=True)
+
+    async def _post_streaming(self, data: dict, consume: Callable[[dict], None]) -> None:
+        # Like _post, but hands each element of the result array to consume() as it is parsed
+        headers = {'Content-Type': 'application/json-rpc'}
+        try:
+            async with self.governor.request():
+                with API_REQUEST_SECONDS.time(instance=self.metrics_label, method=data['method']):
+                    async with self.session.post(self.api_url, json=data, headers=headers) as response:
+                        response.raise_for_status()
+                        async for item in iter_result(response):
+                            consume(item)
+        except (CircuitOpenError, JsonRpcError):
+            raise
+        except Exception:
+            API_REQUEST_ERRORS.inc(instance=self.metrics_label, method=data['method'])
+            raise
+
+    async def _refresh_auth(self, stale_token: Optional[str]) -> bool:
+        if self.auth is None or not self.auth.can_relogin:
+            return False
+        logging.warning(f"Zabbix session for {self.api_url} is no longer valid, logging in again")
+        await self.auth.relogin(stale_token)
+        self.auth_token = self.auth.auth_token
+        return True
+
+    async def api_request(self, method: str, params: dict) -> dict:
+        token = self.auth_token
+        result = await self._post(self._build_request(method, params))
+        if ZabbixAuth.is_auth_error(result) and await self._refresh_auth(token):
+            result = await self._post(self._build_request(method, params))
+        if 'error' in result:
+            API_REQUEST_ERRORS.inc(instance=self.metrics_label, method=method)
+        return result
 
+    async def api_request_streaming(self, method: str, params: dict, consume: Callable[[dict], None]) -> None:
+        token = self.auth_token
         try:
-            result = await self.api_request('hostgroup.get', {'filter': {'name': ['Servers']}})
-            groups = result.get('result', [])
-            if groups:
-                self.servers_group_id = groups[0]['groupid']
-                return self.servers_group_id
-            else:
-                logging.error("'Servers' group not found")
-                return None
+            await self._post_streaming(self._build_request(method, params), consume)
+        except JsonRpcError as e:
+            API_REQUEST_ERRORS.inc(instance=self.metrics_label, method=method)
+            if not (ZabbixAuth.is_auth_error({'error': e.error}) and await self._refresh_auth(token)):
+                raise
+            await self._post_streaming(self._build_request(method, params), consume)
+
+    async def _post_batch(self, calls: List[Tuple[str, dict]]) -> List[dict]:
+        requests = [self._build_request(method, params) for method, params in calls]
+        responses = await self._post(requests)
+
+        if not isinstance(responses, list):
+            error = responses.get('error', {}) if isinstance(responses, dict) else {}
+            raise BatchNotSupportedError(error.get('data') or error.get('message') or 'non-array response')
+
+        # Responses may come back in any order, match them to the calls by id
+        by_id = {response.get('id'): response for response in responses}
+        return [
+            by_id.get(request['id'], {'error': {'message': f"No response for request id {request['id']}"}})
+            for request in requests
+        ]
+
+    async def api_request_batch(self, calls: List[Tuple[str, dict]]) -> List[dict]:
+        if len(calls) > 1 and self.batch_supported:
+            try:
+                token = self.auth_token
+                responses = await self._post_batch(calls)
+                if any(ZabbixAuth.is_auth_error(response) for response in responses) and await self._refresh_auth(token):
+                    responses = await self._post_batch(calls)
+                return responses
+            except BatchNotSupportedError as e:
+                logging.warning(f"JSON-RPC batch rejected by {self.api_url}, falling back to single requests: {str(e)}")
+                self.batch_supported = False
+
+        return list(await asyncio.gather(*(self.api_request(method, params) for method, params in calls)))
+
+    async def get_host_groups(self) -> Dict[str, str]:
+        # groupid -> name of the configured host groups, cached for the life of this collector
+        if self.groups is not None:
+            return self.groups
+
+        # Failures propagate: an unreachable Zabbix must fail the run, not look like an empty plant
+        try:
+            result = self.check_result('hostgroup.get', await self.api_request('hostgroup.get', {'filter': {'name': self.host_groups}}))
         except Exception as e:
-            logging.error(f"Error fetching 'Servers' group ID: {str(e)}")
-            return None
+            logging.error(f"Error fetching host groups {self.host_groups}: {str(e)}")
+            raise
+        self.groups = {group['groupid']: group['name'] for group in result}
+        missing = [name for name in self.host_groups if name not in self.groups.values()]
+        if missing:
+            logging.error(f"Host groups not found: {', '.join(missing)}")
+        return self.groups
 
     async def get_servers(self) -> List[ServerInfo]:
-        servers_group_id = await self.get_servers_group_id()
-        if not servers_group_id:
+        groups = await self.get_host_groups()
+        if not groups:
             return []
 
         try:
-            result = await self.api_request('host.get', {'groupids': [servers_group_id]})
-            return [ServerInfo(name=host['name'], hostid=host['hostid']) for host in result.get('result', [])]
+            result = self.check_result('host.get', await self.api_request('host.get', {'groupids': list(groups)}))
+            return [ServerInfo(name=host['name'], hostid=host['hostid']) for host in result]
         except Exception as e:
             logging.error(f"Error fetching servers: {str(e)}")
-            return []
+            raise
+
+    async def get_inventory(self) -> dict:
+        # Hosts of the configured groups and the ids of the items collected from them (see host_inventory.py)
+        groups = await self.get_host_groups()
+        servers = await self.get_servers()
+        items = {server['hostid']: [] for server in servers}
+        calls = [('item.get', {**self.host_items_params(chunk), 'output': ['itemid', 'hostid']})
+                 for chunk in self.host_chunks(list(items))]
+        batches = [calls[start:start + self.batch_size] for start in range(0, len(calls), self.batch_size)]
+        # Unlike a collection run, a partial item list must not replace the cached one, so any failure raises
+        for results in await asyncio.gather(*(self.api_request_batch(batch) for batch in batches)):
+            for result in results:
+                for item in self.check_result('item.get', result):
+                    items.setdefault(item['hostid'], []).append(item['itemid'])
+        return {
+            'refreshed_at': time.time(),
+            'url': self.instance['url'],
+            'username': self.instance.get('username'),
+            'host_groups': self.host_groups,
+            'groups': groups,
+            'hosts': {server['hostid']: server['name'] for server in servers},
+            'items': items
+        }
 
-    async def get_server_availability(self, server: ServerInfo) -> bool:
+    @staticmethod
+    def check_result(method: str, response: dict) -> list:
+        if 'error' in response:
+            error = response['error']
+            raise Exception(f"{method} failed: {error.get('data') or error.get('message')}")
+        return response.get('result', [])
+
+    async def get_server_availability(self, server: ServerInfo) -> Optional[bool]:
         try:
             result = await self.api_request('item.get', {
                 'hostids': [server['hostid']],
-                'search': {'key_': 'agent.ping'},
-                'sortfield': 'name'
+                'filter': {'key_': 'agent.ping'}
             })
-            items = result.get('result', [])
-            if items:
-                return items[0]['lastvalue'] == '1'
-            return False
+            return self.parse_availability(self.check_result('item.get', result))
         except Exception as e:
             logging.error(f"Error checking server availability: {str(e)}")
-            return False
+            return None
 
     async def get_server_disk_space(self, hostid: str) -> List[DiskSpaceData]:
         try:
             result = await self.api_request('item.get', {
                 'hostids': [hostid],
-                'search': {'key_': 'vfs.fs.size'},
-                'sortfield': 'name'
+                'search': {'key_': 'vfs.fs.size[*'},
+                'searchWildcardsEnabled': True
             })
-            items = result.get('result', [])
-            disk_space_data = {}
-            for item in items:
-                if item['key_'].startswith('vfs.fs.size['):
-                    mount_point = item['key_'].split('[')[1].split(',')[0]
-                    if mount_point not in disk_space_data:
-                        disk_space_data[mount_point] = {}
-
-                    if item['key_'].endswith('total]'):
-                        disk_space_data[mount_point]['total_space'] = float(item['lastvalue'])
-                    elif item['key_'].endswith('used]'):
-                        disk_space_data[mount_point]['used_space'] = float(item['lastvalue'])
-                    elif item['key_'].endswith('free]'):
-                        disk_space_data[mount_point]['free_space'] = float(item['lastvalue'])
-
-            result = []
-            for mount_point, data in disk_space_data.items():
-                if all(key in data for key in ['total_space', 'used_space', 'free_space']):
-                    total_space = data['total_space']
-                    free_space_percent = (data['free_space'] / total_space * 100) if total_space > 0 else 0
-                    result.append(DiskSpaceData(
-                        mount_point=mount_point,
-                        total_space=data['total_space'],
-                        used_space=data['used_space'],
-                        free_space=data['free_space'],
-                        free_space_percent=free_space_percent
-                    ))
-
-            return result
+            return self.parse_disk_space(self.check_result('item.get', result))
         except Exception as e:
             logging.error(f"Error fetching disk space data: {str(e)}")
             return []
+
+    async def get_server_data(self, server: ServerInfo,
+                              itemids_by_host: Optional[Dict[str, List[str]]] = None) -> HostData:
+        items_by_host = await self.get_items_by_host([server['hostid']], itemids_by_host)
+        return self.build_host_data(items_by_host[server['hostid']])
+
+    @staticmethod
+    def host_items_params(hostids: List[str]) -> dict:
+        return {
+            'hostids': hostids,
+            'search': {'key_': HOST_ITEM_KEYS},
+            'searchByAny': True,
+            'searchWildcardsEnabled': True
+        }
+
+    def host_chunks(self, hostids: List[str]) -> List[List[str]]:
+        return [hostids[start:start + self.host_chunk_size] for start in range(0, len(hostids), self.host_chunk_size)]
+
+    def item_requests(self, hostids: List[str],
+                      itemids_by_host: Optional[Dict[str, List[str]]] = None) -> List[Tuple[List[str], dict]]:
+        # One item.get per host chunk. With cached item ids the request names the items instead of searching
+        # their keys, and chunks whose hosts have no cached items need no request at all.
+        requests = []
+        for chunk in self.host_chunks(hostids):
+            if itemids_by_host is None:
+                requests.append((chunk, self.host_items_params(chunk)))
+                continue
+            itemids = [itemid for hostid in chunk for itemid in itemids_by_host.get(hostid, [])]
+            if itemids:
+                requests.append((chunk, {'itemids': itemids}))
+        return requests
+
+    async def get_items_by_host(self, hostids: List[str],
+                                itemids_by_host: Optional[Dict[str, List[str]]] = None) -> Dict[str, Optional[List[dict]]]:
+        # Hosts whose item.get failed map to None, so callers can tell "no data" from "no items"
+        items_by_host = {hostid: [] for hostid in hostids}
+
+        async def fetch_chunks(requests: List[Tuple[List[str], dict]]) -> None:
+            try:
+                results = await self.api_request_batch([('item.get', params) for _, params in requests])
+            except Exception as e:
+                logging.error(f"Error fetching items for {sum(len(chunk) for chunk, _ in requests)} hosts: {str(e)}")
+                results = [{'error': {'message': str(e)}}] * len(requests)
+
+            for (chunk, _), result in zip(requests, results):
+                if 'error' in result:
+                    logging.error(f"item.get failed for {len(chunk)} hosts, their availability is unknown: "
+                                  f"{result['error'].get('data') or result['error'].get('message')}")
+                    for hostid in chunk:
+                        items_by_host[hostid] = None
+                    self.failed_hostids.update(chunk)
+                    continue
+                for item in result.get('result', []):
+                    items_by_host.setdefault(item['hostid'], []).append(item)
+
+        requests = self.item_requests(hostids, itemids_by_host)
+        batches = [requests[start:start + self.batch_size] for start in range(0, len(requests), self.batch_size)]
+        await asyncio.gather(*(fetch_chunks(batch) for batch in batches))
+        return items_by_host
+
+    async def get_item_states_by_host(self, hostids: List[str],
+                                      itemids_by_host: Optional[Dict[str, List[str]]] = None) -> Dict[str, Optional['HostItemState']]:
+        # Streaming counterpart of get_items_by_host: one request per chunk (no JSON-RPC batching), and
+        # items are folded into per-host state while the response is still arriving
+        states = {hostid: HostItemState() for hostid in hostids}
+
+        def consume(item: dict) -> None:
+            state = states.get(item['hostid'])
+            if state is None:
+                state = states[item['hostid']] = HostItemState()
+            state.add(item)
+
+        async def fetch_chunk(chunk: List[str], params: dict) -> None:
+            try:
+                await self.api_request_streaming('item.get', params, consume)
+            except Exception as e:
+                logging.error(f"item.get failed for {len(chunk)} hosts, their availability is unknown: {str(e)}")
+                for hostid in chunk:
+                    states[hostid] = None
+                self.failed_hostids.update(chunk)
+
+        await asyncio.gather(*(fetch_chunk(chunk, params) for chunk, params in self.item_requests(hostids, itemids_by_host)))
+        return states
+
+    async def iter_history(self, itemids_by_type: Dict[str, List[str]], time_from: int, time_till: int,
+                           slice_seconds: int, item_chunk_size: int = 200,
+                           trends: bool = False) -> AsyncIterator[Tuple[int, List[dict]]]:
+        # Yields (slice_end, records) pages in chronological slice order so callers only ever hold one slice
+        method = 'trend.get' if trends else 'history.get'
+        for slice_from in range(time_from, time_till, slice_seconds):
+            slice_till = min(slice_from + slice_seconds, time_till)
+            calls = []
+            for value_type, itemids in itemids_by_type.items():
+                for start in range(0, len(itemids), item_chunk_size):
+                    params = {
+                        'itemids': itemids[start:start + item_chunk_size],
+                        'time_from': slice_from,
+                        'time_till': slice_till - 1
+                    }
+                    if not trends:
+                        params.update({'history': int(value_type), 'sortfield': 'clock', 'sortorder': 'ASC'})
+                    calls.append(params)
+
+            results = await asyncio.gather(*(self.api_request(method, params) for params in calls))
+            for result in results:
+                yield slice_till, self.check_result(method, result)
+
+    async def get_bulk_server_data(self, servers: List[ServerInfo],
+                                   itemids_by_host: Optional[Dict[str, List[str]]] = None) -> Dict[str, HostData]:
+        hostids = [server['hostid'] for server in servers]
+        if self.stream_responses:
+            states = await self.get_item_states_by_host(hostids, itemids_by_host)
+            return {hostid: self.host_data_from_state(state) for hostid, state in states.items()}
+        items_by_host = await self.get_items_by_host(hostids, itemids_by_host)
+        return {hostid: self.build_host_data(items) for hostid, items in items_by_host.items()}
+
+    def build_host_data(self, items: Optional[List[dict]]) -> HostData:
+        return self.host_data_from_state(HostItemState.from_items(items) if items is not None else None)
+
+    def host_data_from_state(self, state: Optional['HostItemState']) -> HostData:
+        if state is None:
+            return HostData(is_available=None, timestamp=None, disk_space=[], metrics=[])
+        return HostData(
+            is_available=state.availability(),
+            timestamp=self.sample_time(state.ping[1]) if state.ping else None,
+            disk_space=state.disk_space(self.last_clocks, self.seen_clocks),
+            metrics=state.host_metrics(self.last_clocks, self.seen_clocks)
+        )
+
+    @staticmethod
+    def sample_time(lastclock) -> Optional[datetime]:
+        clock = int(lastclock or 0)
+        return datetime.fromtimestamp(clock) if clock > 0 else None
+
+    @staticmethod
+    def disk_space_data(mount_point: str, values: Dict[str, float],
+                        timestamp: Optional[datetime]) -> Optional[DiskSpaceData]:
+        # Needs total/used/free; the percentage comes from pfree or pused when the host has those items
+        if not all(key in values for key in ['total_space', 'used_space', 'free_space']):
+            return None
+        total_space = values['total_space']
+        if 'free_space_percent' in values:
+            free_space_percent = values['free_space_percent']
+        elif 'used_space_percent' in values:
+            free_space_percent = 100 - values['used_space_percent']
+        else:
+            free_space_percent = (values['free_space'] / total_space * 100) if total_space > 0 else 0
+        return DiskSpaceData(
+            mount_point=mount_point,
+            total_space=total_space,
+            used_space=values['used_space'],
+            free_space=values['free_space'],
+            free_space_percent=free_space_percent,
+            timestamp=timestamp
+        )
+
+    @staticmethod
+    def parse_availability(items: List[dict]) -> Optional[bool]:
+        for item in items:
+            if 'agent.ping' in item['key_']:
+                return item['lastvalue'] == '1'
+        # Without an agent.ping item there is nothing to judge the host by
+        return None
+
+    @staticmethod
+    def parse_disk_space(items: List[dict], last_clocks: Optional[Dict[str, int]] = None,
+                         seen_clocks: Optional[Dict[str, int]] = None) -> List[DiskSpaceData]:
+        return HostItemState.from_items(items).disk_space(last_clocks, seen_clocks)
+
+
+class HostItemState:
+    # Compact per-host summary of item.get results. The streaming path folds items in as they are
+    # parsed, so a host costs a few small dicts instead of its full item list. Adding the same item
+    # twice (a retried request) leaves the state unchanged.
+    __slots__ = ('ping', 'disk_values', 'disk_clocks', 'metric_values')
+
+    def __init__(self):
+        self.ping: Optional[Tuple[str, int]] = None  # (lastvalue, lastclock) of the agent.ping item
+        self.disk_values: Dict[str, Dict[str, float]] = {}  # mount point -> field -> value
+        self.disk_clocks: Dict[str, Dict[str, int]] = {}  # mount point -> itemid -> lastclock
+        # itemid -> (metric, instance, value, lastclock) for items in HOST_METRIC_ITEMS
+        self.metric_values: Dict[str, Tuple[str, Optional[str], float, int]] = {}
+
+    @classmethod
+    def from_items(cls, items: List[dict]) -> 'HostItemState':
+        state = cls()
+        for item in items:
+            state.add(item)
+        return state
+
+    def add(self, item: dict) -> None:
+        key = item['key_']
+        if 'agent.ping' in key:
+            if self.ping is None:
+                self.ping = (item['lastvalue'], int(item.get('lastclock') or 0))
+            return
+        clock = int(item.get('lastclock') or 0)
+        disk_field = disk_item_field(key)
+        if disk_field:
+            # Items that never received a value report lastclock 0 and an empty lastvalue. Skipping the field
+            # leaves the mount incomplete, so only that mount is dropped.
+            if clock > 0:
+                mount_point, field = disk_field
+                try:
+                    self.disk_values.setdefault(mount_point, {})[field] = float(item['lastvalue'])
+                except ValueError:
+                    logging.debug(f"Skipping non-numeric value of item {key}: {item['lastvalue']!r}")
+                    return
+                self.disk_clocks.setdefault(mount_point, {})[item.get('itemid')] = clock
+            return
+
+        metric = host_metric(key)
+        if metric and clock > 0:
+            try:
+                self.metric_values[item.get('itemid')] = (metric[0], metric[1], float(item['lastvalue']), clock)
+            except ValueError:
+                logging.debug(f"Skipping non-numeric value of item {key}: {item['lastvalue']!r}")
+
+    def availability(self) -> Optional[bool]:
+        # Without an agent.ping item there is nothing to judge the host by
+        return self.ping[0] == '1' if self.ping else None
+
+    def disk_space(self, last_clocks: Optional[Dict[str, int]] = None,
+                   seen_clocks: Optional[Dict[str, int]] = None) -> List[DiskSpaceData]:
+        result = []
+        for mount_point, data in self.disk_values.items():
+            clocks = self.disk_clocks[mount_point]
+            disk_data = ZabbixCollector.disk_space_data(
+                mount_point, data, ZabbixCollector.sample_time(max(clocks.values())))
+            if disk_data is None:
+                continue
+            # In incremental mode skip mounts where no item got a new value since the last stored one
+            if last_clocks is not None and not any(
+                    clock > last_clocks.get(itemid, 0) for itemid, clock in clocks.items()):
+                continue
+            if seen_clocks is not None:
+                seen_clocks.update(clocks)
+            result.append(disk_data)
+
+        return result
+
+    def host_metrics(self, last_clocks: Optional[Dict[str, int]] = None,
+                     seen_clocks: Optional[Dict[str, int]] = None) -> List[HostMetricData]:
+        result = []
+        for itemid, (metric, instance, value, clock) in self.metric_values.items():
+            if last_clocks is not None and clock <= last_clocks.get(itemid, 0):
+                continue
+            if seen_clocks is not None:
+                seen_clocks[itemid] = clock
+            result.append(HostMetricData(metric=metric, instance=instance, value=value,
+                                         timestamp=ZabbixCollector.sample_time(clock)))
+        return result
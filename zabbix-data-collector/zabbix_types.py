@@ -1,4 +1,5 @@
-from typing import TypedDict, List
+from datetime import datetime
+from typing import TypedDict, List, Optional
 
 class ZabbixInstance(TypedDict):
     url: str
@@ -6,6 +7,19 @@ class ZabbixInstance(TypedDict):
     username: str
     password: str
     token: str
+    bulk_collection: bool
+    host_groups: List[str]
+    host_chunk_size: int
+    max_concurrency: int
+    min_concurrency: int
+    rate_limit: float
+    rate_burst: int
+    latency_target: float
+    circuit_failures: int
+    circuit_cooldown: float
+    jsonrpc_batch: bool
+    jsonrpc_batch_size: int
+    stream_responses: bool
 
 class ServerInfo(TypedDict):
     name: str
@@ -17,3 +31,24 @@ class DiskSpaceData(TypedDict):
     used_space: float
     free_space: float
     free_space_percent: float
+    timestamp: Optional[datetime]
+
+class HostMetricData(TypedDict):
+    metric: str  # name from item_keys.HOST_METRIC_ITEMS
+    instance: Optional[str]  # e.g. the mount point for per-filesystem metrics
+    value: float
+    timestamp: Optional[datetime]
+
+class HostData(TypedDict):
+    is_available: Optional[bool]  # None when Zabbix could not tell (no agent.ping item, or the request failed)
+    timestamp: Optional[datetime]
+    disk_space: List[DiskSpaceData]
+    metrics: List[HostMetricData]
+
+class InstanceRunStatus(TypedDict):
+    plant_name: str
+    url: str
+    status: str  # 'success', 'partial' (some hosts missing) or 'failure'
+    rows_written: int
+    started_at: datetime
+    finished_at: datetime